@@ -0,0 +1,46 @@
+"""
+    Benchmark throughput of tiny experiments in parallel, with a fresh worker process per experiment
+    (the default, tasks_per_child=1) versus long-lived workers.
+
+    Usage (from the root of the repository, PYTHONPATH=. is not needed when runexp is installed): PYTHONPATH=. python benchmarks/bench_pool.py [n_experiments] [num_workers]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import runexp
+
+
+class BenchRunner(runexp.Runner):
+    def make_kwargs(self, config): return config
+
+
+def tiny(seed):
+    return dict(value=seed)
+
+
+def bench(n_experiments, num_workers, tasks_per_child):
+    output_dir = os.path.join(tempfile.mkdtemp(), "results")
+    runner = BenchRunner(tiny, output=output_dir)
+
+    start = time.perf_counter()
+    runner.run_batch(dict(seed=dict(_from=0, _to=n_experiments)), parallel=True, num_workers=num_workers,
+                     show_progress=False, tasks_per_child=tasks_per_child)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_experiments = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(1, multiprocessing.cpu_count() - 1)
+
+    results = []
+    for tasks_per_child in [1, 10, 100, None]:
+        elapsed = bench(n_experiments, num_workers, tasks_per_child)
+        results.append((tasks_per_child, elapsed))
+
+    print(f"{n_experiments} experiments on {num_workers} workers")
+    print(f"{'tasks/child':>12} {'time (s)':>10} {'exp/s':>10}")
+    for tasks_per_child, elapsed in results:
+        print(f"{str(tasks_per_child):>12} {elapsed:>10.3f} {n_experiments / elapsed:>10.1f}")
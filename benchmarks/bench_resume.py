@@ -0,0 +1,59 @@
+"""
+    Benchmark resuming a batch: time `Runner.filter_experiments` for growing numbers of planned configs,
+    with 3/4 of them already finished on disk. The time per config should stay (roughly) constant.
+    The first call rebuilds the manifest from disk, the second one only reads the manifest.
+
+    Usage (from the root of the repository, PYTHONPATH=. is not needed when runexp is installed): PYTHONPATH=. python benchmarks/bench_resume.py [max_configs]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import runexp
+from runexp.utils import CONFIG, dt_to_str_in_dict
+
+
+class BenchRunner(runexp.Runner):
+    def make_kwargs(self, config): return config
+
+
+def dummy(**kwargs):
+    return dict()
+
+
+def populate(output_dir, configs):
+    # write finished runs by hand, the way `Runner.save_result` lays them out
+    for idx, config in enumerate(configs, start=1):
+        full_dir = os.path.join(output_dir, f"{idx:06d}")
+        os.mkdir(full_dir)
+        with open(os.path.join(full_dir, CONFIG), "w") as f:
+            f.write(json.dumps(dt_to_str_in_dict(config)))
+
+
+def bench(n_configs):
+    output_dir = os.path.join(tempfile.mkdtemp(), "results")
+    runner = BenchRunner(dummy, output=output_dir)
+
+    planned = runexp.unravel_dict(dict(solver=["a", "b", "c", "d"], seed=dict(_from=0, _to=n_configs // 4), time_limit=60))
+    populate(output_dir, planned[:3 * len(planned) // 4])
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        remaining = runner.filter_experiments(planned)
+        timings.append(time.perf_counter() - start)
+        assert len(remaining) == len(planned) - 3 * len(planned) // 4
+    return len(planned), timings
+
+
+if __name__ == "__main__":
+    max_configs = int(sys.argv[1]) if len(sys.argv) > 1 else 32_000
+
+    print(f"{'configs':>10} {'disk (s)':>10} {'us/config':>10} {'manifest (s)':>13} {'us/config':>10}")
+    n = 2_000
+    while n <= max_configs:
+        n_configs, (disk, manifest) = bench(n)
+        print(f"{n_configs:>10} {disk:>10.3f} {1e6 * disk / n_configs:>10.1f} {manifest:>13.3f} {1e6 * manifest / n_configs:>10.1f}")
+        n *= 2
@@ -0,0 +1,74 @@
+"""
+    Benchmark throughput of experiments which save several artifacts, saving results in the worker (the default)
+    versus handing them to a writer thread (async_writes=True), on a tmpfs and on a slowed-down directory.
+    The slow directory adds a fixed latency to every file opened or renamed in it, like a network filesystem.
+
+    Usage (from the root of the repository, PYTHONPATH=. is not needed when runexp is installed): PYTHONPATH=. python benchmarks/bench_writer.py [n_experiments] [num_workers] [latency_ms]
+"""
+import builtins
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import runexp
+
+
+class BenchRunner(runexp.Runner):
+    def make_kwargs(self, config): return config
+
+
+def experiment(seed):
+    time.sleep(0.01)
+    return dict(value=seed, trace=list(range(100)), stats=dict(mean=seed / 2, name=f"run{seed}"), log=f"seed {seed}\n" * 10)
+
+
+def slow_down(root, latency):
+    # patched before the workers are forked, so they inherit it
+    original_open, original_os_open, original_replace = builtins.open, os.open, os.replace
+
+    def slow(func):
+        def wrapper(path, *args, **kwargs):
+            if str(path).startswith(root):
+                time.sleep(latency)
+            return func(path, *args, **kwargs)
+        return wrapper
+
+    builtins.open, os.open, os.replace = slow(original_open), slow(original_os_open), slow(original_replace)
+    return lambda: setattr(builtins, "open", original_open) or setattr(os, "open", original_os_open) or setattr(os, "replace", original_replace)
+
+
+def bench(root, n_experiments, num_workers, executor, async_writes):
+    output_dir = tempfile.mkdtemp(dir=root)
+    runner = BenchRunner(experiment, output=output_dir, confirm=False, async_writes=async_writes)
+
+    start = time.perf_counter()
+    runner.run_batch(dict(seed=dict(_from=0, _to=n_experiments)), parallel=True, num_workers=num_workers, executor=executor,
+                     show_progress=False, tasks_per_child=None, status_interval=None)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_experiments = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(1, multiprocessing.cpu_count() - 1)
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.005
+
+    tmpfs = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    results = []
+    for name in ["tmpfs", "slow"]:
+        root = tempfile.mkdtemp(dir=tmpfs)
+        restore = slow_down(root, latency) if name == "slow" else lambda: None
+        try:
+            for executor in ["process", "thread"]:
+                for async_writes in [False, True]:
+                    results.append((name, executor, async_writes, bench(root, n_experiments, num_workers, executor, async_writes)))
+        finally:
+            restore()
+            shutil.rmtree(root, ignore_errors=True) # /dev/shm is kept in memory
+
+    print(f"{n_experiments} experiments on {num_workers} workers, {1000 * latency:.1f} ms per file operation in the slow directory")
+    print(f"{'directory':>10} {'executor':>10} {'async':>6} {'time (s)':>10} {'exp/s':>10}")
+    for name, executor, async_writes, elapsed in results:
+        print(f"{name:>10} {executor:>10} {str(async_writes):>6} {elapsed:>10.3f} {n_experiments / elapsed:>10.1f}")
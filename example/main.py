@@ -5,18 +5,26 @@ from data_wrappers import HandyDataWrapper
 
 class MyRunner(Runner):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shared_keys = ["arg1"] # all seeds use the same data wrapper
+
     def description(self, config):
         return f"Handling seed {config['seed']}"
 
+    def prepare_shared(self, config_subset):
+        val = config_subset['arg1']
+        cname = val['name']
+        # instantiate class, only once for all experiments with the same `arg1`
+        return eval(cname)(val['v1'], val['v2'])
+
     def make_kwargs(self, config):
 
         output = dict()
 
         for key, val in config.items():
             if key == "arg1":
-                cname = val['name']
-                # instantiate class
-                output['arg1'] = eval(cname)(val['v1'], val['v2'])
+                output['arg1'] = self.shared(config)
             else:
                 output[key] = val
 
@@ -37,9 +45,28 @@ if __name__ == "__main__":
         runner = eval(args.runner)(func=eval(args.func),
                                    output=args.output,
                                    memory_limit=args.memory_limit,
-                                   printlog=True)
+                                   timeout=args.timeout,
+                                   cpu_limit=args.cpu_limit,
+                                   store=args.store,
+                                   compression=args.compression,
+                                   profile=args.profile,
+                                   profile_sample=args.profile_sample,
+                                   max_attempts=args.max_attempts,
+                                   retry_backoff=args.retry_backoff,
+                                   cache_dir=args.cache_dir,
+                                   cache_max_size=args.cache_max_size,
+                                   async_writes=args.async_writes,
+                                   printlog=True,
+                                   confirm=not args.yes)
 
         if args.unravel is True:
-            runner.run_batch(config, parallel=args.parallel, num_workers=args.num_workers)
+            runner.run_batch(config, parallel=args.parallel, num_workers=args.num_workers, executor=args.executor, shard=args.shard,
+                             tasks_per_child=args.tasks_per_child,
+                             chunksize=args.chunksize,
+                             ordered=args.ordered,
+                             longest_first=args.longest_first,
+                             status_interval=args.status_interval,
+                             status_port=args.status_port,
+                             only_failed=args.only_failed)
         else:
             runner.run_one(config)
@@ -1,8 +1,21 @@
 from .runexp import *
+from .command import CommandRunner
 
 import argparse
 from multiprocessing import cpu_count
 
+def parse_shard(value):
+    """
+        Parse a shard "i/n" from the command line into a tuple (i, n)
+    """
+    try:
+        i, n = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected shard of the form i/n, but got {value}")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value}, should be between 1/{n} and {n}/{n}")
+    return i, n
+
 def default_parser():
 
     parser = argparse.ArgumentParser()
@@ -13,6 +26,27 @@ def default_parser():
     parser.add_argument("output", type=str, help="Directory to output results of experiments")
     parser.add_argument("-u", "--unravel", action="store_true", help="Whether to unravel config file to run experiments in a batch (will unravel lists in configuration file to separate configs)")
     parser.add_argument("--parallel", action="store_true", help="Wheter to run experiments in paralell, only useful if `--unravel` is True")
-    parser.add_argument("--num-workers", action="store", type=int, default=cpu_count()-1, help=f"Number of threads to use for parallelization (=nb of experiments running in parallel, default={cpu_count()-1})")
+    parser.add_argument("--num-workers", action="store", type=int, default=None, help=f"Number of experiments running in parallel (default={max(1, cpu_count()-1)} processes, {THREAD_WORKERS} threads or {ASYNC_WORKERS} coroutines)")
+    parser.add_argument("--executor", action="store", choices=["process", "thread", "asyncio"], default="process", help="Run parallel experiments in worker processes, in threads, or as coroutines for `async def` experiment functions (default=process)")
+    parser.add_argument("--tasks-per-child", action="store", type=int, default=1, help="Number of experiments each worker runs before it is replaced by a fresh process, use 0 to keep workers alive for the whole batch (default=1)")
     parser.add_argument("--memory_limit", action="store", type=int, default=-1, help="Memory limit in MB to use by each experiment, only works on Linux.")
+    parser.add_argument("--timeout", action="store", type=float, default=None, help="Maximum wall time of each experiment in seconds, after which it is killed")
+    parser.add_argument("--cpu_limit", action="store", type=int, default=-1, help="Maximum cpu time of each experiment in seconds, after which it is killed, only works on Linux.")
+    parser.add_argument("--store", action="store", choices=["both", "only"], default=None, help="Also write configs and scalar and small dict results to a result store in the output directory (both), or only to the store instead of to files (only)")
+    parser.add_argument("--compression", action="store", choices=["gzip", "lzma", "zstd"], default=None, help="Compress artifacts while writing them, numbers are never compressed")
+    parser.add_argument("--profile", action="store", choices=["cpu", "mem"], default=None, help="Run experiments under cProfile (cpu) or tracemalloc (mem) and save the profile next to their results")
+    parser.add_argument("--profile-sample", action="store", type=float, default=1.0, help="Fraction of experiments to profile (default=1, all experiments)")
+    parser.add_argument("--status-interval", action="store", type=float, default=None, help="Write the live status of the batch to status.json in the output directory every SECONDS")
+    parser.add_argument("--status-port", action="store", type=int, default=None, help="Serve the live status of the batch on http://127.0.0.1:PORT")
+    parser.add_argument("--max-attempts", action="store", type=int, default=1, help="Number of times an experiment raising an exception is tried before it is recorded as failed (default=1)")
+    parser.add_argument("--retry-backoff", action="store", type=float, default=0.0, help="Seconds to wait before retrying a failed experiment, doubled for every next retry")
+    parser.add_argument("--cache-dir", action="store", type=str, default=None, help="Result cache shared between output directories, experiments which ran before with the same code and config are linked from it instead of run again")
+    parser.add_argument("--cache-max-size", action="store", type=float, default=None, help="Size in MB the result cache is pruned to after each batch, least recently used results first")
+    parser.add_argument("--async-writes", action="store_true", help="Save results in writer threads while workers run their next experiments, cannot be used with --store")
+    parser.add_argument("--only-failed", action="store_true", help="Only run the experiments which failed before again")
+    parser.add_argument("--chunksize", action="store", type=int, default=None, help="Number of experiments sent to a worker at once, by default based on the number of experiments and workers")
+    parser.add_argument("--ordered", action="store_true", help="Collect finished experiments in the order they were submitted, instead of as soon as they finish")
+    parser.add_argument("--longest-first", action="store_true", help="Run the experiments with the longest expected runtime first, based on finished experiments in the output directory")
+    parser.add_argument("--shard", action="store", type=parse_shard, default=None, help="Only run the i-th of n equal parts of the batch, given as i/n. Shards can run on different machines sharing the output directory")
+    parser.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation when the output directory already exists")
     return parser
\ No newline at end of file
@@ -0,0 +1,11 @@
+import sys
+
+from .cache import main as cache_main
+
+COMMANDS = dict(cache=cache_main)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"usage: python -m runexp {{{','.join(COMMANDS)}}} ...")
+        sys.exit(2)
+    COMMANDS[sys.argv[1]](sys.argv[2:])
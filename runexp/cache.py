@@ -0,0 +1,173 @@
+import argparse
+import errno
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+import uuid
+from os.path import join
+
+from .utils import config_hash, timestamp
+
+ENTRY = "cache_entry.json"
+FICLONE = 0x40049409 # ioctl to reflink a file on Linux (btrfs, xfs, ...)
+
+# The result cache is a directory shared between output directories, with one sub-directory per cached result.
+# Its name is a hash of the version of the experiment (by default the source code of the experiment function and `make_kwargs`)
+# and the config hash, so the same experiment with the same config always finds the same entry.
+# Entries hold the artifacts of a finished run, and `cache_entry.json` describing it, last used time is the modification time of that file.
+
+def code_version(*funcs):
+    """
+        Fingerprint of the source code of functions, or of their bytecode if the source is not available
+    """
+    sha = hashlib.sha1()
+    for func in funcs:
+        func = inspect.unwrap(func)
+        try:
+            sha.update(inspect.getsource(func).encode("utf-8"))
+        except (OSError, TypeError):
+            code = getattr(func, "__code__", None)
+            sha.update(code.co_code if code is not None else getattr(func, "__qualname__", repr(func)).encode("utf-8"))
+    return sha.hexdigest()
+
+def materialize(src, dst):
+    """
+        Make `dst` have the content of `src`, using a hardlink, a reflink or a copy, whichever works first
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """
+        Content-addressed cache of experiment results in `cache_dir`.
+        Holds at most `max_size` MB and drops entries not used for `max_age` days when pruned, least recently used entries first.
+    """
+
+    def __init__(self, cache_dir, max_size=None, max_age=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, version, config):
+        return hashlib.sha1(f"{version}:{config_hash(config)}".encode("utf-8")).hexdigest()
+
+    def lookup(self, key, files=True, row=False):
+        """
+            Entry of `key`, or None if it is not in the cache.
+            With `files`, the entry should hold all artifacts as files, with `row` it should hold a row for the result store.
+        """
+        path = join(self.cache_dir, key)
+        try:
+            with open(join(path, ENTRY), "r") as f:
+                entry = json.load(f)
+            os.utime(join(path, ENTRY)) # used now
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if (files and not entry['files_complete']) or (row and entry.get('row') is None):
+            return None
+        return entry | dict(path=path)
+
+    def restore(self, entry, dirname):
+        """
+            Put the artifacts of a cache entry in the run directory `dirname`, returns their names
+        """
+        for fname in entry['artifacts']:
+            materialize(join(entry['path'], fname), join(dirname, fname))
+        return list(entry['artifacts'])
+
+    def add(self, key, dirname, artifacts, info):
+        """
+            Add the artifacts of the finished run in `dirname` to the cache under `key`, `info` is kept in the entry.
+            The entry is built next to the cache and moved in place at once, so it is never seen half-written.
+        """
+        tmp_path = join(self.cache_dir, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.mkdir(tmp_path)
+        try:
+            size = 0
+            for fname in artifacts:
+                materialize(join(dirname, fname), join(tmp_path, fname))
+                size += os.path.getsize(join(tmp_path, fname))
+            with open(join(tmp_path, ENTRY), "w") as f:
+                json.dump(info | dict(key=key, artifacts=artifacts, size=size, created=timestamp()), f, default=str)
+            try:
+                if os.path.exists(join(self.cache_dir, key)): # e.g., an entry without a row for the result store
+                    shutil.rmtree(join(self.cache_dir, key))
+                os.rename(tmp_path, join(self.cache_dir, key))
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT): # someone else added it at the same time
+                    raise e
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def entries(self):
+        """
+            All entries in the cache, most recently used first, with their size (bytes) and last used time (seconds since epoch)
+        """
+        entries = []
+        for dirent in os.scandir(self.cache_dir):
+            if not dirent.is_dir() or dirent.name.startswith("."):
+                continue
+            try:
+                with open(join(dirent.path, ENTRY), "r") as f:
+                    entry = json.load(f)
+                entry['last_used'] = os.path.getmtime(join(dirent.path, ENTRY))
+            except (FileNotFoundError, json.JSONDecodeError): # broken entry, remove it when pruning
+                entry = dict(key=dirent.name, size=0, last_used=0.0)
+            entries.append(entry | dict(path=dirent.path))
+        return sorted(entries, key=lambda entry: -entry['last_used'])
+
+    def prune(self, max_size=None, max_age=None):
+        """
+            Remove entries not used for `max_age` days, and the least recently used entries until the cache holds at most `max_size` MB.
+            Defaults to the limits of the cache, returns the number of removed entries and the number of bytes they took.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        max_age = self.max_age if max_age is None else max_age
+        removed, freed, total = 0, 0, 0
+        for entry in self.entries():
+            total += entry['size']
+            too_old = max_age is not None and time.time() - entry['last_used'] > max_age * 24 * 3600
+            too_big = max_size is not None and total > max_size * 1024 * 1024
+            if too_old or too_big or entry['last_used'] == 0.0:
+                shutil.rmtree(entry['path'], ignore_errors=True)
+                removed += 1
+                freed += entry['size']
+                total -= entry['size']
+        return removed, freed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m runexp cache", description="Inspect or prune a runexp result cache")
+    parser.add_argument("command", choices=["inspect", "prune"])
+    parser.add_argument("cache_dir", type=str, help="Directory of the result cache")
+    parser.add_argument("--max-size", type=float, default=None, help="Remove least recently used entries until the cache holds at most this many MB")
+    parser.add_argument("--max-age", type=float, default=None, help="Remove entries which were not used for this many days")
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir)
+    if args.command == "prune":
+        removed, freed = cache.prune(args.max_size, args.max_age)
+        print(f"Removed {removed} entries, freed {freed / 1024 / 1024:.1f} MB")
+        return
+
+    entries = cache.entries()
+    print(f"{len(entries)} entries, {sum(e['size'] for e in entries) / 1024 / 1024:.1f} MB in {args.cache_dir}")
+    for entry in entries:
+        last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry['last_used']))
+        print(f"{entry['key']}  {entry['size'] / 1024:>10.1f} KB  last used {last_used}  {json.dumps(entry.get('config'))}")
@@ -0,0 +1,197 @@
+import ast
+import json
+import os
+import resource
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from functools import partial
+from os.path import join, abspath
+
+from .runexp import Runner, EXECUTORS, RSS_UNIT
+from .cache import code_version
+from .utils import config_hash
+
+STDOUT = "stdout.txt"
+STDERR = "stderr.txt"
+METRICS = "### metrics ###" # line after which a command prints its metrics
+METRICS_TAIL = 64 * 1024 # bytes at the end of stdout searched for metrics
+ERR_TAIL = 4 * 1024 # bytes at the end of stderr kept in the error of a failed command
+RESERVED = ("stdout", "stderr", "err", "config", "runexp_meta") # artifacts written by runexp itself, metrics with these names get METRIC_PREFIX
+METRIC_PREFIX = "metric_"
+
+# Commands write their output straight to files in the run directory, so it is never held in memory.
+# The metrics block is the last part of stdout, one metric per line, e.g.,
+#
+#     ### metrics ###
+#     objective: 42.5
+#     status=optimal
+#
+# values are parsed as json or python literals where possible, and kept as strings otherwise.
+# A metric named like an artifact runexp writes itself (see RESERVED) is renamed, e.g., "stdout" becomes "metric_stdout".
+# The cpu time and peak memory in the meta of a run are those of its command, read when the command is reaped,
+# as the worker (or with the thread executor, the worker thread) only waits for it.
+
+_usage = threading.local() # resource usage of the commands run by the current experiment of each thread
+
+class CommandRunner(Runner):
+    """
+        Runner for experiments which run an external command.
+        `command` is a command line template (a string or a list of arguments), filled in with the output of `make_kwargs`
+        using `str.format`, e.g., "solver --seed {seed} --instance {data[name]} --out {run_dir}/solution.txt".
+        `run_dir` is the absolute path of the run directory of the experiment.
+        By default, `make_kwargs` passes the config as is.
+    """
+
+    def __init__(self, command, output, memory_limit=-1, cpu_limit=-1, version=None, **kwargs):
+        """
+            Initialize the command runner, see `Runner` for the other parameters
+
+            :param command: the command line template, a string which is split like a shell would, or a list of arguments
+            :param memory_limit: the maximum amount of memory the command may allocate in MB - ONLY WORKS ON LINUX!
+            :param cpu_limit: the maximum cpu time of the command in seconds, after which it is killed - ONLY WORKS ON LINUX!
+            :param version: version of the experiment in the result cache, defaults to a fingerprint of the command template and `make_kwargs`.
+                            Set it to the version of the tool to not reuse results of older versions.
+        """
+        self.command = command
+        if version is None and kwargs.get("cache_dir") is not None:
+            version = code_version(type(self).make_kwargs) + config_hash(dict(command=command))
+        # the limits are applied to the command instead of the worker, so they can be used with the thread executor as well
+        super().__init__(None, output, version=version, **kwargs)
+        self.command_memlimit = memory_limit
+        self.command_cpulimit = cpu_limit
+
+    def make_kwargs(self, config):
+        return config
+
+    def command_line(self, kwargs):
+        """
+            The arguments of the command of an experiment, `kwargs` is the output of `make_kwargs` together with `run_dir`
+        """
+        if isinstance(self.command, str):
+            return shlex.split(self.command.format(**kwargs))
+        return [str(arg).format(**kwargs) for arg in self.command]
+
+    def parse_metrics(self, stdout_tail):
+        """
+            Result of an experiment from the end of its stdout: the metrics after the last `### metrics ###` line, see above
+        """
+        _, found, block = stdout_tail.rpartition(METRICS)
+        if not found:
+            return dict()
+        metrics = dict()
+        for line in block.splitlines():
+            key, sep, value = line.partition(":") if ":" in line.split("=")[0] else line.partition("=")
+            if not sep or not key.strip():
+                continue
+            key = key.strip()
+            if key.split(".")[0] in RESERVED:
+                key = METRIC_PREFIX + key
+            metrics[key] = _parse_value(value.strip())
+        return metrics
+
+    def check_executor(self, executor):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor}, should be one of {list(EXECUTORS)}")
+        if executor == "asyncio":
+            raise ValueError("Commands run in their own process, use the process or thread executor")
+        if executor == "thread" and self.profile is not None:
+            raise ValueError("Profiles trace a whole process, use the process executor")
+
+    def call_func(self, kwargs, profile_dir=None, run_dir=None):
+        """
+            Run the command of an experiment with its stdout and stderr going to `stdout.txt` and `stderr.txt` in the run directory.
+            A command running longer than the timeout or the cpu limit is killed, together with the processes it started,
+            and gets an `err` and `status` ("timeout") in its result like other experiments.
+            A command exiting with a non-zero status raises a `subprocess.CalledProcessError`, so it is retried or recorded as failed.
+        """
+        args = self.command_line(kwargs | dict(run_dir=abspath(run_dir)))
+        # the limits are set in the forked child before the command starts, which is not safe when forking from a worker thread (thread executor),
+        # there they are set right after the command started, so it may allocate memory or start processes before they apply
+        in_thread = threading.current_thread() is not threading.main_thread()
+        with open(join(run_dir, STDOUT), "wb") as stdout, open(join(run_dir, STDERR), "wb") as stderr:
+            start = time.monotonic()
+            # in its own session, so processes started by the command are killed with it
+            proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr, start_new_session=True,
+                                    preexec_fn=None if in_thread else partial(self.limit, 0))
+            try:
+                if in_thread:
+                    self.limit(proc.pid)
+                returncode = _wait(proc, self.timeout)
+            except subprocess.TimeoutExpired:
+                _kill(proc)
+                err = f"TimeoutError: command did not finish within {self.timeout} seconds"
+                return dict(err=err, status="timeout", elapsed=time.monotonic() - start), "timeout"
+            except BaseException: # e.g., KeyboardInterrupt, which the command does not get in its own session
+                _kill(proc)
+                raise
+        elapsed = time.monotonic() - start
+
+        if returncode == -signal.SIGXCPU:
+            err = f"TimeoutError: command exceeded cpu limit of {self.command_cpulimit} seconds"
+            return dict(err=err, status="timeout", elapsed=elapsed), "timeout"
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args, stderr=_tail(join(run_dir, STDERR), ERR_TAIL))
+        return self.parse_metrics(_tail(join(run_dir, STDOUT), METRICS_TAIL)), "done"
+
+    def experiment_usage(self, before):
+        """
+            Cpu time and peak memory of the commands of the experiment, instead of those of the worker
+        """
+        usages, _usage.commands = getattr(_usage, "commands", []), []
+        if len(usages) == 0: # e.g., the command could not be started
+            return super().experiment_usage(before)
+        return dict(cpu_user=sum(u.ru_utime for u in usages), cpu_system=sum(u.ru_stime for u in usages),
+                    peak_rss_mb=max(u.ru_maxrss for u in usages) / RSS_UNIT)
+
+    def limit(self, pid):
+        """
+            Apply the memory and cpu limits of the runner to the command with process id `pid`, 0 for the current process
+        """
+        for which, limit in ((resource.RLIMIT_AS, self.command_memlimit * 1024 * 1024), (resource.RLIMIT_CPU, self.command_cpulimit)):
+            if limit > 0:
+                _, hard = resource.getrlimit(which)
+                resource.prlimit(pid, which, (int(limit), hard))
+
+
+def _parse_value(value):
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(value)
+        except (ValueError, SyntaxError):
+            pass
+    return value
+
+def _tail(fname, size):
+    with open(fname, "rb") as f:
+        f.seek(max(0, os.path.getsize(fname) - size))
+        return f.read().decode("utf-8", errors="replace")
+
+def _wait(proc, timeout=None):
+    """
+        Wait for a command to exit and reap it, keeping its resource usage for `CommandRunner.experiment_usage`.
+        Returns its return code, raises `subprocess.TimeoutExpired` if it is still running after `timeout` seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        pid, status, usage = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+        if pid != 0:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        time.sleep(min(delay, remaining))
+        delay = min(2 * delay, 0.05)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    _usage.commands = getattr(_usage, "commands", []) + [usage]
+    return proc.returncode
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError: # finished just now
+        pass
+    _wait(proc)
@@ -0,0 +1,72 @@
+import cProfile
+import glob
+import io
+import pstats
+import tracemalloc
+from os.path import join
+
+from natsort import natsorted
+
+PROFILES = ("cpu", "mem")
+PROFILE_CPU = "profile.prof" # cProfile stats, see `pstats`
+PROFILE_MEM = "profile_mem.txt" # top allocations
+PROFILE_SNAPSHOT = "profile_mem.snapshot" # tracemalloc snapshot, used to aggregate the allocations of a batch
+TOP = 25 # number of lines in reports
+
+# Profiles are written to the run directory of an experiment, next to its results.
+# With "cpu", the experiment function runs under cProfile, with "mem", tracemalloc traces its allocations.
+
+def profile_call(func, kwargs, kind, dirname):
+    """
+        Call `func(**kwargs)` under a profiler of `kind` ("cpu" or "mem") and write the profile to `dirname`
+    """
+    if kind == "cpu":
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, **kwargs)
+        finally:
+            profiler.dump_stats(join(dirname, PROFILE_CPU))
+
+    tracemalloc.start()
+    try:
+        return func(**kwargs)
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = _own_allocations(tracemalloc.take_snapshot())
+        tracemalloc.stop()
+        snapshot.dump(join(dirname, PROFILE_SNAPSHOT))
+        with open(join(dirname, PROFILE_MEM), "w") as f:
+            f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MB\n")
+            f.write(f"Top {TOP} lines by memory still allocated at the end of the experiment:\n")
+            f.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:TOP])
+
+def _own_allocations(snapshot):
+    # leave out allocations of the profiler itself
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+
+def profile_summary(output_dir, kind="cpu", top=TOP):
+    """
+        Merge the profiles of all runs in `output_dir` into one summary of the hotspots of the batch.
+        For "cpu", the functions with most cumulative time over all runs, for "mem" the lines with most memory still allocated summed over all runs.
+    """
+    if kind not in PROFILES:
+        raise ValueError(f"Unknown profile {kind}, should be one of {list(PROFILES)}")
+    fnames = natsorted(glob.glob(join(glob.escape(output_dir), "*", PROFILE_CPU if kind == "cpu" else PROFILE_SNAPSHOT)))
+    if len(fnames) == 0:
+        return f"No {kind} profiles found in {output_dir}"
+
+    out = io.StringIO()
+    if kind == "cpu":
+        stats = pstats.Stats(*fnames, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        return out.getvalue()
+
+    total = dict()
+    for fname in fnames:
+        for stat in tracemalloc.Snapshot.load(fname).statistics("lineno"):
+            size, count = total.get(stat.traceback, (0, 0))
+            total[stat.traceback] = (size + stat.size, count + stat.count)
+    out.write(f"Top {top} lines by memory still allocated at the end of the experiment, summed over {len(fnames)} runs:\n")
+    for traceback, (size, count) in sorted(total.items(), key=lambda item: -item[1][0])[:top]:
+        out.write(f"{traceback}: size={size / 1024:.1f} KiB, count={count}\n")
+    return out.getvalue()
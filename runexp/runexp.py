@@ -1,27 +1,138 @@
+import asyncio
+import collections
+import contextlib
+import inspect
 import logging
 import multiprocessing
 import os
-import copy
 import platform
 import resource
+import select
+import shutil
+import signal
 import sys
+import itertools
 import json
 import pickle
+import time
 import traceback
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from tqdm.auto import tqdm
+from natsort import natsorted
 
-from .utils import dict_subset, unravel_dict, can_stringify, can_write_to_json, CONFIG, dt_to_str_in_dict
+from .utils import dict_subset, flat_dict, unravel_dict, iter_unravel, count_unravel, unravel_at, can_stringify, can_write_to_json, CONFIG, META, dt_to_str_in_dict, config_hash, \
+    append_manifest, extend_manifest, load_manifest, timestamp, MANIFEST, SHARD_MANIFEST, FINISHED
 
 from os.path import dirname, abspath, join
 from os import listdir
 
+from .store import ResultStore, store_row, STORE, SHARD_STORE, STORE_BATCH, RESULT
+from .serializers import register_serializer, unregister_serializer, find_serializer, get_serializer, check_compression, open_file, COMPRESSIONS
+from .shared import memoize, config_subset, shared_objects, LRUCache, SHARED_CACHE_SIZE, SHARED_LOOKAHEAD
+from .telemetry import Telemetry, STATUS, SHARD_STATUS, STATUS_INTERVAL
+from .profiling import profile_call, profile_summary, PROFILES, PROFILE_CPU, PROFILE_MEM, PROFILE_SNAPSHOT
+from .cache import ResultCache, code_version
+from .writer import result_writer, flush_writer, WRITER_QUEUE, WRITER_THREADS
 from .messages import *
-from .utils import dirlock
+
+EXECUTORS = ("process", "thread", "asyncio")
+MAX_CHUNKSIZE = 8 # largest chunk of experiments sent to a worker process at once, see `auto_chunksize`
+THREAD_WORKERS = min(32, multiprocessing.cpu_count() + 4) # default number of threads of the thread executor, like `ThreadPoolExecutor`
+ASYNC_WORKERS = 64 # default number of experiments running at the same time with the asyncio executor
+SEED_KEYS = ("seed", "random_state", "rng", "rep", "repetition", "trial") # config keys which do not change the cost of an experiment, see `cost_config`
+UNCOMPRESSED = ("err", "status") # bookkeeping of failed runs, read by `rebuild_manifest` and by hand
+TMP_PREFIX = ".tmp." # prefix of files which are not completely written yet
+RSS_UNIT = 1024 * 1024 if sys.platform == "darwin" else 1024 # `ru_maxrss` is in bytes on macOS, in kilobytes on Linux
+
+# Directories are allocated and manifests appended to under the lock of the runner, shared by all workers of its batches.
+# A multiprocessing lock works for threads as well, but it can only be passed to processes when they start,
+# so pool workers get it from `_init_worker` and runners sent to them pick it up when they are unpickled.
+_worker_dirlock = None
+
+def _init_worker(dirlock):
+    global _worker_dirlock
+    _worker_dirlock = dirlock
+
+class RemoteTraceback(Exception):
+    """
+        Traceback of an exception raised in the process of an experiment
+    """
+    def __str__(self):
+        return self.args[0]
+
+def rusage():
+    """
+        Resource usage of this process and of its waited-for children, or only of the current thread in a worker thread (Linux only)
+    """
+    if threading.current_thread() is not threading.main_thread() and hasattr(resource, "RUSAGE_THREAD"):
+        return [resource.getrusage(resource.RUSAGE_THREAD)]
+    return [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+
+@contextlib.contextmanager
+def staged_path(path, atomic=True):
+    """
+        Path to write the file `path` to, which is renamed to `path` once it is completely written.
+        The extension is kept, so the file is still compressed according to it.
+    """
+    if not atomic:
+        yield path
+        return
+    tmp_path = join(os.path.dirname(path), TMP_PREFIX + os.path.basename(path))
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): # writing failed
+            os.remove(tmp_path)
+
+def empty_dir(dirname, keep=()):
+    """
+        Remove all files and subdirectories in `dirname` (e.g., written by a command, see `CommandRunner`), except those named in `keep`
+    """
+    for entry in os.scandir(dirname):
+        if entry.name in keep:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+def resource_usage(before):
+    """
+        Cpu time used since `before`, a result of `rusage`,
+        and the peak memory (high-water mark of the resident set size) of this process and its children in MB.
+    """
+    after = rusage()
+    return dict(cpu_user=sum(a.ru_utime - b.ru_utime for a, b in zip(after, before)),
+                cpu_system=sum(a.ru_stime - b.ru_stime for a, b in zip(after, before)),
+                peak_rss_mb=max(a.ru_maxrss for a in after) / RSS_UNIT)
+
+def is_seed_key(key):
+    """
+        Whether a (flattened) config key is a seed or repetition, e.g., "seed", "data/seed" or "model_seed"
+    """
+    name = key.split("/")[-1].lower()
+    return name in SEED_KEYS or name.endswith("seed")
+
+def _advance(attempts, outcome=None, error=None):
+    """
+        Next step of `Runner.attempts`, after sending it the outcome of the previous step or throwing the error it raised.
+        Returns ("done", (result, status)) once there are no more attempts.
+    """
+    try:
+        return attempts.throw(error) if error is not None else attempts.send(outcome)
+    except StopIteration as stop:
+        return "done", stop.value
 
 class Runner:
 
-    def __init__(self, func, output, printlog=True, memory_limit=-1, log_level=logging.INFO):
+    def __init__(self, func, output, printlog=True, memory_limit=-1, log_level=logging.INFO, confirm=True,
+                 timeout=None, cpu_limit=-1, store=None, compression=None, profile=None, profile_sample=1.0,
+                 max_attempts=1, retry_on=(Exception,), retry_backoff=0.0, cache_dir=None, cache_max_size=None, cache_max_age=None,
+                 version=None, async_writes=False):
         """
             Initialize the experiment runner
 
@@ -30,22 +141,75 @@ class Runner:
             :param printlog: whether to print the log generated by the runner and or experiment to stdout
             :param memory_limit: the maximum amount of memory to allocate for this experiment in MB - ONLY WORKS ON LINUX!
             :param log_level: the logging level to use (see logging module for more info)
+            :param confirm: whether to ask for confirmation when the output directory already exists
+            :param timeout: the maximum wall time of an experiment in seconds, after which it is killed
+            :param cpu_limit: the maximum cpu time of an experiment in seconds, after which it is killed - ONLY WORKS ON LINUX!
+            :param store: whether to also write the config and scalar and small dict results to a result store in the output directory ("both"),
+                            or to write those to the result store instead of to files ("only"). Default None only writes to files.
+            :param compression: compress artifacts while writing them, with "gzip", "lzma" or "zstd" (requires the zstandard package before python 3.14).
+                            Numbers, `err.txt` and `status.txt` are never compressed.
+            :param profile: run experiments under a cpu ("cpu", cProfile) or memory ("mem", tracemalloc) profiler, and save the profile in their run directory
+            :param profile_sample: fraction of experiments to profile, chosen by the hash of their config so the same experiments are profiled when run again
+            :param max_attempts: number of times an experiment is tried before it is recorded as failed
+            :param retry_on: exception type(s) for which a failed experiment is tried again, other exceptions fail it right away
+            :param retry_backoff: seconds to wait before the first retry, doubled for every next retry
+            :param cache_dir: directory of a result cache shared between output directories. Experiments which ran before with the same version and config
+                            are not run again, their artifacts are linked (or copied) from the cache instead. See `runexp.cache`.
+            :param cache_max_size: size in MB the result cache is pruned to after each batch, least recently used results are removed first
+            :param cache_max_age: results in the cache not used for this many days are removed after each batch
+            :param version: version of the experiment in the result cache, change it to invalidate cached results.
+                            Defaults to a fingerprint of the source code of `func` and `make_kwargs`.
+            :param async_writes: hand results to writer threads in the process of the worker, which save them while the worker runs its next experiment,
+                            and mark them as finished in batches. The config is written last, under a temporary name which is renamed when complete.
+                            At most `writer_queue` results wait to be written in each process, a worker waits for the writers when there are more.
+                            Cannot be used with a result store.
         """
+        if store not in (None, "both", "only"):
+            raise ValueError(f"Unknown result store mode {store}, should be None, 'both' or 'only'")
+        check_compression(compression)
+        if profile is not None and profile not in PROFILES:
+            raise ValueError(f"Unknown profile {profile}, should be None or one of {list(PROFILES)}")
+        if async_writes is True and store is not None:
+            raise ValueError("Results for the result store are collected by the main process, they cannot be written asynchronously")
 
         try:
             os.makedirs(output)
         except FileExistsError:
-            answer = input(OUTPUT_DIR_EXISTS.format(output))
-            if answer == "y":
-                pass
-            else:
-                exit(1)
+            if confirm is True:
+                answer = input(OUTPUT_DIR_EXISTS.format(output))
+                if answer == "y":
+                    pass
+                else:
+                    exit(1)
         self.func = func
         self.output_dir = output
         self.digits = 6
         self.memlimit = memory_limit
-        global dirlock
-        dirlock = multiprocessing.Lock()
+        self.timeout = timeout
+        self.cpulimit = cpu_limit
+        self.store = store
+        self.compression = compression
+        self.profile = profile
+        self.profile_sample = profile_sample
+        self.max_attempts = max_attempts
+        self.retry_on = retry_on
+        self.retry_backoff = retry_backoff
+        self.async_writes = async_writes
+        self.writer_queue = WRITER_QUEUE # results waiting to be written in each process with `async_writes`
+        self.writer_threads = WRITER_THREADS # threads writing results in each process with `async_writes`
+        self.cache = None if cache_dir is None else ResultCache(cache_dir, cache_max_size, cache_max_age)
+        self.version = version
+        if self.cache is not None and version is None:
+            self.version = code_version(func, type(self).make_kwargs)
+        self.shard = None
+        self.cost_keys = None # (flattened) config keys determining the runtime of an experiment, see `estimate_cost`
+        self.cost_history = None
+        self.shared_keys = None # (flattened) config keys determining the objects shared by experiments, see `prepare_shared`
+        self.shared_cache_size = SHARED_CACHE_SIZE
+        self.thread_workers = THREAD_WORKERS # concurrency of the thread executor, when `num_workers` is not given
+        self.async_workers = ASYNC_WORKERS # concurrency of the asyncio executor, when `num_workers` is not given
+        self.n_skipped = 0
+        self.dirlock = multiprocessing.Lock()
 
         if printlog is True:
             logging.basicConfig(level=log_level,
@@ -54,6 +218,16 @@ class Runner:
         else:
             raise NotImplementedError("Logging to file not yet implemented")
 
+    def __getstate__(self):
+        # the runner is sent to the workers with each experiment, the cost history is only used by the main process
+        state = self.__dict__.copy()
+        state['cost_history'] = None
+        state['dirlock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.dirlock = _worker_dirlock if _worker_dirlock is not None else multiprocessing.Lock()
 
     #####################################################
     #        Methods that should be overwritten         #
@@ -65,6 +239,25 @@ class Runner:
     def description(self, config) -> str:
         return f"Implement `description(config)` for {type(self)} to get informative progress"
 
+    def prepare_shared(self, config_subset):
+        """
+            Build the objects shared by all experiments with the same values for the keys in `shared_keys`, e.g., a big dataset used by all seeds.
+            `config_subset` maps each of the `shared_keys` to its value in the config.
+            Get the shared objects in `make_kwargs` using `self.shared(config)`, they are built once and kept for the next experiments.
+        """
+        return None
+
+    def estimate_cost(self, config):
+        """
+            Predicted runtime of an experiment, used to run the longest experiments first.
+            By default, the mean wall time of finished experiments in the output directory with the same values for `cost_keys`
+            (all keys except seeds if not set), or the mean wall time of all finished experiments if there are none.
+        """
+        if self.cost_history is None:
+            self.cost_history = self.load_cost_history()
+        history, default = self.cost_history
+        return history.get(config_hash(self.cost_config(config)), default)
+
     #####################################################
     #                   Main dispatch                   #
     #####################################################
@@ -74,40 +267,289 @@ class Runner:
             Run experiment with given configuration file.
             Config file will **not** be unraveled, and simply be passed to the experiment function
         """
-        pool = multiprocessing.Pool(1, maxtasksperchild=1, initargs=(dirlock,))
-        pool.map(self.run_experiment,[config])
+        pool = multiprocessing.Pool(1, maxtasksperchild=1, initializer=_init_worker, initargs=(self.dirlock,))
+        output = pool.map(self.run_experiment,[config])
+        pool.close()
+        pool.join()
+        if self.store is not None:
+            store = ResultStore(self.output_dir, self.store_name())
+            self.store_results(store, output)
+            store.close()
 
-    def run_batch(self, config, parallel=False, num_workers=None, show_progress=True):
-
-        configs = unravel_dict(config)
-        total_exp = len(configs)
+    def run_batch(self, config, parallel=False, num_workers=None, show_progress=True, shard=None, tasks_per_child=1,
+                  chunksize=None, ordered=False, longest_first=False, timeout=None, status_interval=None, status_port=None,
+                  only_failed=False, executor="process"):
+        """
+            Unravel the config and run all experiments not yet finished in the output directory.
 
-        print("Filtering experiments based on disk")
-        configs = self.filter_experiments(configs)
-        print(f"Skipping {total_exp - len(configs)} experiments")
-        self.n_experiments = len(configs)
-        print(f"Running {len(configs)} remaining experiments")
+            :param num_workers: number of experiments running at the same time in a parallel batch.
+                            Defaults to the number of cpus minus one for processes, and to `thread_workers` / `async_workers` for the other executors.
 
+            :param shard: tuple (i, n) to only run the i-th of n equal parts of the batch, with 1 <= i <= n.
+                            Shards can run on different machines sharing the output directory.
+            :param tasks_per_child: number of experiments each worker process runs before it is replaced by a fresh one.
+                            Use a higher number or None or 0 (never replace workers) to avoid starting a process per experiment.
+            :param chunksize: number of experiments sent to a worker at once, None to pick one based on the number of experiments and workers.
+                            A worker runs at least one chunk before it is replaced.
+            :param ordered: whether to collect finished experiments in the order they were submitted, instead of as soon as they finish
+            :param longest_first: whether to run the experiments with the highest `estimate_cost` first.
+                            All remaining configs are kept in memory to sort them.
+            :param timeout: the maximum wall time of an experiment in seconds, overrides the timeout of the runner for this batch
+            :param status_interval: seconds between writing the live status of the batch to `status.json` in the output directory, None (default) to not keep a status.
+                            It holds the throughput, counts of running, finished, failed and timed out experiments, an estimate of the remaining time based on `estimate_cost`,
+                            how busy each worker is and the longest running experiments.
+            :param status_port: serve the live status on http://127.0.0.1:<status_port> as well, 0 for any free port.
+                            Keeps a status every `STATUS_INTERVAL` seconds if no `status_interval` is given.
+            :param only_failed: only run the experiments of the batch which failed before, in their original run directory
+            :param executor: how a parallel batch runs its experiments: in worker processes ("process"), in threads of this process ("thread"),
+                            or as coroutines on an event loop in this process ("asyncio", for experiment functions defined with `async def`).
+                            Threads and coroutines suit experiments which mostly wait, e.g., on an external solver or on disk,
+                            but share the memory, resource limits and cpu of this process.
+        """
+        if timeout is not None and timeout != self.timeout: # only for this batch
+            previous, self.timeout = self.timeout, timeout
+            try:
+                return self.run_batch(config, parallel, num_workers, show_progress, shard, tasks_per_child, chunksize, ordered, longest_first,
+                                      None, status_interval, status_port, only_failed, executor)
+            finally:
+                self.timeout = previous
+        if tasks_per_child == 0: # as given on the command line
+            tasks_per_child = None
         if parallel is True:
-            if num_workers is None:
-                num_workers = multiprocessing.cpu_count() - 1
+            self.check_executor(executor)
 
-            print(f"Running in parallel with {num_workers} threads")
+        # configs are unraveled and filtered lazily while they are handed out, so they never have to be all in memory
+        total_exp = count_unravel(config)
+        if shard is None:
+            configs = iter_unravel(config)
+        else:
+            i, n = shard
+            if not 1 <= i <= n:
+                raise ValueError(f"Invalid shard {i}/{n}, should be between 1/{n} and {n}/{n}")
+            start, stop = (i - 1) * total_exp // n, i * total_exp // n
+            print(f"Running shard {i}/{n}: experiments {start} to {stop} of {total_exp}")
+            configs = iter_unravel(config, start=start, stop=stop)
+            total_exp = stop - start
+        self.shard = shard
 
-            manager = multiprocessing.Manager()
-            dirlock = manager.Lock()
+        if only_failed is True:
+            print(f"Unraveled config to {total_exp} experiments, only failed experiments will run again")
+            tasks = self.iter_failed_experiments(configs)
+            if longest_first is True:
+                print("Sorting experiments by estimated cost")
+                tasks = sorted(tasks, key=lambda task: self.estimate_cost(task[0]), reverse=True)
+                self.check_cost_estimates([config for config, _ in tasks])
+        else:
+            print(f"Unraveled config to {total_exp} experiments, finished experiments on disk will be skipped")
+            configs = self.iter_filter_experiments(configs)
+            if longest_first is True:
+                print("Sorting experiments by estimated cost")
+                configs = sorted(configs, key=self.estimate_cost, reverse=True)
+                self.check_cost_estimates(configs)
+            # output directories are reserved up front, so workers do not have to search for one
+            tasks = zip(configs, self.free_indices())
 
-            pool = multiprocessing.Pool(num_workers, maxtasksperchild=1, initargs=(dirlock,))
-            lst = list(tqdm(pool.imap(self.run_experiment, configs), total=len(configs)))
+        # skipped experiments count towards progress as well
+        pbar = tqdm(total=total_exp, disable=not show_progress)
+        n_done, n_failed = 0, 0
+        written = [] # run directories handed to a writer with `async_writes`
 
-        else:
-            if show_progress: pbar = tqdm(total=len(configs))
-            for config in configs:
-                if show_progress: pbar.set_description(self.description(config))
-                self.run_experiment(config)
-                if show_progress: pbar.update()
+        # results for the store are written in batches by this process
+        store = None if self.store is None else ResultStore(self.output_dir, self.store_name())
+        to_store = []
+
+        telemetry = None
+        if status_interval is None and status_port is not None:
+            status_interval = STATUS_INTERVAL
+        if status_interval is not None:
+            by_cost = longest_first or self.cost_keys is not None or type(self).estimate_cost is not Runner.estimate_cost
+            telemetry = Telemetry(self, total_exp, self.status_name(), status_interval, status_port,
+                                  pbar=pbar if parallel is True else None, by_cost=by_cost)
+            tasks = telemetry.track(tasks)
+            telemetry.start()
+
+        def collect(output):
+            nonlocal n_done, n_failed, to_store
+            n_done += 1
+            pbar.update(n_done + self.n_skipped - pbar.n)
+            record = output[1] if store is not None else output
+            if self.async_writes is True:
+                written.append(record['dir'])
+            elif record['status'] == "failed":
+                n_failed += 1
+            if store is not None:
+                if telemetry is not None: # the run is only marked as finished in the manifest once the batch is written to the store
+                    telemetry.update(output[1])
+                to_store.append(output)
+                if len(to_store) >= STORE_BATCH:
+                    self.store_results(store, to_store)
+                    to_store = []
+
+        try:
+            if parallel is True and executor == "thread":
+                num_workers = num_workers or self.thread_workers
+                print(f"Running in parallel with {num_workers} threads")
+                self.run_threads(tasks, num_workers, ordered, collect)
+
+            elif parallel is True and executor == "asyncio":
+                num_workers = num_workers or self.async_workers
+                print(f"Running in parallel with {num_workers} coroutines")
+                asyncio.run(self.run_coroutines(tasks, num_workers, ordered, collect))
 
-    def run_experiment(self, config):
+            elif parallel is True:
+                if num_workers is None:
+                    num_workers = max(1, multiprocessing.cpu_count() - 1)
+
+                if chunksize is None:
+                    # based on the experiments which still have to run, counted up to where the chunksize no longer depends on it
+                    first_tasks = list(itertools.islice(tasks, 4 * num_workers * MAX_CHUNKSIZE))
+                    tasks = itertools.chain(first_tasks, tasks)
+                    chunksize = self.auto_chunksize(len(first_tasks), num_workers, tasks_per_child)
+
+                print(f"Running in parallel with {num_workers} processes")
+
+                if type(self).prepare_shared is not Runner.prepare_shared:
+                    # shared objects are built in this process before the workers are forked, so they inherit them
+                    first_tasks = self.preload_shared(tasks)
+                    tasks = itertools.chain(first_tasks, tasks)
+
+                # the pool counts tasks per child in chunks
+                maxtasksperchild = None if tasks_per_child is None else max(1, tasks_per_child // chunksize)
+                pool = multiprocessing.Pool(num_workers, maxtasksperchild=maxtasksperchild, initializer=_init_worker, initargs=(self.dirlock,))
+                imap = pool.imap if ordered is True else pool.imap_unordered
+                for output in imap(self._run_task, tasks, chunksize=chunksize):
+                    collect(output)
+                pool.close()
+                pool.join()
+
+            else:
+                for config, idx in tasks:
+                    pbar.set_description(self.description(config))
+                    collect(self.run_experiment(config, idx))
+
+            if self.async_writes is True: # workers of the process pool wrote everything before they exited
+                flush_writer()
+        finally:
+            if store is not None: # do not lose finished experiments when the batch is interrupted
+                self.store_results(store, to_store)
+                store.close()
+            if telemetry is not None:
+                telemetry.stop()
+
+        pbar.update(n_done + self.n_skipped - pbar.n)
+        pbar.close()
+        self.n_experiments = n_done
+        self.cost_history = None # outdated by the experiments which just ran
+        print(f"Skipped {self.n_skipped} experiments, ran {n_done} remaining experiments")
+        if len(written) > 0:
+            n_failed, n_unwritten = self.count_written(written)
+            if n_unwritten > 0:
+                print(f"{n_unwritten} results were not written, see the errors of the writers above, they run again when the batch is resumed")
+        if self.cache is not None and (self.cache.max_size is not None or self.cache.max_age is not None):
+            removed, freed = self.cache.prune()
+            if removed > 0:
+                print(f"Removed {removed} results from the result cache, freed {freed / 1024 / 1024:.1f} MB")
+        if n_failed > 0:
+            print(f"{n_failed} experiments failed, see their `err.txt`, and run them again using `only_failed`")
+
+    def check_executor(self, executor):
+        """
+            Raise a ValueError if the settings of the runner cannot be used with `executor`
+        """
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor}, should be one of {list(EXECUTORS)}")
+        if executor == "process":
+            return
+        if self.memlimit > 0:
+            raise ValueError(f"Memory limits apply to a whole process, use the process executor instead of {executor}")
+        if self.profile is not None: # a process has a single cProfile or tracemalloc, since python 3.12 profiling in several threads at once fails
+            raise ValueError(f"Profiles trace a whole process, use the process executor instead of {executor}")
+        if executor == "thread" and (self.timeout is not None or self.cpulimit > 0):
+            raise ValueError("Timeouts and cpu limits fork a process for each experiment, which is not safe from threads, use the process or asyncio executor")
+        if executor == "asyncio":
+            if not inspect.iscoroutinefunction(self.func):
+                raise ValueError("The asyncio executor needs an experiment function defined with `async def`, use the thread executor instead")
+            if self.cpulimit > 0:
+                raise ValueError("Cpu limits are not supported by the asyncio executor")
+
+    def run_threads(self, tasks, num_workers, ordered, collect):
+        """
+            Run the (config, index) tasks in `num_workers` threads, passing the output of each experiment to `collect` in this thread.
+            Tasks are handed out from this thread only, a few at a time, so they are still unraveled lazily.
+        """
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="runexp") as executor:
+            pending = collections.deque()
+            for config, idx in tasks:
+                pending.append(executor.submit(self.run_experiment, config, idx))
+                while len(pending) >= 2 * num_workers: # keep all threads busy
+                    self._collect_finished(pending, ordered, collect)
+            while len(pending):
+                self._collect_finished(pending, ordered, collect)
+
+    def _collect_finished(self, pending, ordered, collect):
+        if ordered is True:
+            collect(pending.popleft().result())
+            return
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            pending.remove(future)
+            collect(future.result())
+
+    async def run_coroutines(self, tasks, num_workers, ordered, collect):
+        """
+            Run the (config, index) tasks as coroutines on the running event loop, at most `num_workers` at the same time,
+            passing the output of each experiment to `collect`.
+        """
+        pending = collections.deque()
+        try:
+            for config, idx in tasks:
+                pending.append(asyncio.ensure_future(self.run_experiment_async(config, idx)))
+                while len(pending) >= num_workers:
+                    await self._collect_finished_async(pending, ordered, collect)
+            while len(pending):
+                await self._collect_finished_async(pending, ordered, collect)
+        finally: # e.g., an experiment could not be saved
+            for task in pending:
+                task.cancel()
+
+    async def _collect_finished_async(self, pending, ordered, collect):
+        if ordered is True:
+            collect(await pending.popleft())
+            return
+        finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            pending.remove(task)
+            collect(task.result())
+
+    def auto_chunksize(self, n_experiments, num_workers, tasks_per_child):
+        """
+            Chunksize for dispatching experiments to workers.
+            Similar to `Pool.map`, aim for 4 chunks per worker, but at most `MAX_CHUNKSIZE`:
+            finished experiments are only collected (and counted in the progress bar) once their whole chunk is done,
+            so larger chunks save little dispatching overhead at the cost of a jumpy progress bar and worse load balancing at the end of a batch.
+            When each experiment should run in a fresh process, chunks are single experiments,
+            otherwise the chunksize divides `tasks_per_child`, so workers are replaced after exactly that many experiments.
+        """
+        if tasks_per_child == 1:
+            return 1
+        chunksize = min(max(1, n_experiments // (4 * num_workers)), MAX_CHUNKSIZE)
+        if tasks_per_child is not None:
+            chunksize = max(size for size in range(1, chunksize + 1) if tasks_per_child % size == 0)
+        return chunksize
+
+    def _run_task(self, task):
+        return self.run_experiment(*task)
+
+    def run_experiment(self, config, idx=None):
+        """
+            Run the experiment of a config in a new run directory and save its results.
+            How the experiment ran is saved to `runexp_meta.json`: the pid of the worker, start and end time,
+            time spent in `make_kwargs`, the experiment function and `save_result`, cpu user and system time and peak memory.
+            The peak memory is the high-water mark of the worker, which only covers this experiment when workers run a single experiment.
+            An experiment raising an exception is tried again according to the retry policy of the runner (`max_attempts`, `retry_on`, `retry_backoff`),
+            if it keeps failing it gets status "failed" and its traceback is saved to `err.txt`.
+            With a result cache, an experiment found in the cache is not run, `cached` in its meta holds the cache key instead.
+        """
         if self.memlimit > 0:
             os_name = platform.platform()
             if not os_name.startswith("Linux"): raise ValueError("Currently only support setting memory limits for Linux")
@@ -116,31 +558,360 @@ class Runner:
             print(f"Setting limit to {limit_bytes} bytes")
             resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, hard))
 
-        dirname = self.mkdir()
-        kwargs = self.make_kwargs(config)
         try:
-            result = self.func(**kwargs)
-        except MemoryError as e:
-            result = dict(err=str(traceback.format_exc()))
+            dirname = self.mkdir(idx)
+            meta = dict(pid=os.getpid(), start=timestamp())
+            entry = self.lookup_cache(config)
+            output = None if entry is None else self.restore_result(config, entry, dirname, meta)
+            if output is not None:
+                return output
+            before = rusage()
+            attempts = self.attempts(config, meta)
+            step, value = _advance(attempts)
+            while step != "done":
+                if step == "sleep":
+                    time.sleep(value)
+                    step, value = _advance(attempts)
+                    continue
+                try:
+                    outcome = self.call_func(value, profile_dir=dirname if self.profiled(config) else None, run_dir=dirname)
+                except Exception as e:
+                    step, value = _advance(attempts, error=e)
+                else:
+                    step, value = _advance(attempts, outcome)
+            result, status = value
+            meta |= self.experiment_usage(before)
+        finally:
+            # might need to increase memory limit for writing to file,
+            # and the limit should not stay in place for the next experiment in this worker
+            if self.memlimit > 0:
+                resource.setrlimit(resource.RLIMIT_AS, (current_soft, hard))
 
-        # might need to increase memory limit for writing to file
-        if self.memlimit > 0:
-            resource.setrlimit(resource.RLIMIT_AS, (current_soft, hard))
+        if self.async_writes is True:
+            result_writer(self.writer_queue, self.writer_threads).submit(self, config, result, status, dirname, meta)
+            # how the run finished is only known once it is written, see `count_written`
+            return dict(dir=os.path.basename(dirname), status="running")
+        return self.save_experiment(config, result, status, dirname, meta)
+
+    async def run_experiment_async(self, config, idx=None):
+        """
+            Like `run_experiment`, for experiment functions defined with `async def`, run by the asyncio executor.
+            The run directory is made and the results are saved in a thread, so the event loop keeps running the other experiments.
+            A timeout cancels the experiment, the cpu times and peak memory in its meta are those of the whole process.
+        """
+        dirname = await asyncio.to_thread(self.mkdir, idx)
+        meta = dict(pid=os.getpid(), start=timestamp())
+        entry = self.lookup_cache(config)
+        output = None if entry is None else await asyncio.to_thread(self.restore_result, config, entry, dirname, meta)
+        if output is not None:
+            return output
+        before = rusage()
+        attempts = self.attempts(config, meta)
+        step, value = _advance(attempts)
+        while step != "done":
+            if step == "sleep":
+                await asyncio.sleep(value)
+                step, value = _advance(attempts)
+                continue
+            start = time.perf_counter()
+            try:
+                outcome = await asyncio.wait_for(self.func(**value), self.timeout), "done"
+            except asyncio.TimeoutError as e: # not the builtin TimeoutError before python 3.11
+                if self.timeout is None or time.perf_counter() - start < self.timeout: # raised by the experiment itself
+                    step, value = _advance(attempts, error=e)
+                else:
+                    err = f"TimeoutError: experiment did not finish within {self.timeout} seconds"
+                    step, value = _advance(attempts, (dict(err=err, status="timeout", elapsed=time.perf_counter() - start), "timeout"))
+            except Exception as e:
+                step, value = _advance(attempts, error=e)
+            else:
+                step, value = _advance(attempts, outcome)
+        result, status = value
+        meta |= self.experiment_usage(before)
+        return await asyncio.to_thread(self.save_experiment, config, result, status, dirname, meta)
+
+    def save_experiment(self, config, result, status, dirname, meta, mark_finished=True):
+        """
+            Save the result of an experiment which ran, and add it to the result cache if it finished successfully.
+            A result which can not be saved, e.g., as it can not be serialized, fails the run: the artifacts written so far are removed
+            and the traceback is saved to `err.txt`, so the batch goes on and the experiment can be run again with `only_failed`.
+        """
+        try:
+            output = self.save_result(config, result, dirname, meta=meta | dict(wall_time=meta['func_time'], status=status), mark_finished=mark_finished)
+        except Exception as e:
+            logging.warning(f"Could not save the result of {dirname}: {e}")
+            empty_dir(dirname, keep=(PROFILE_CPU, PROFILE_MEM, PROFILE_SNAPSHOT))
+            result, status = dict(err=traceback.format_exc(), status="failed"), "failed"
+            output = self.save_result(config, result, dirname, meta=meta | dict(wall_time=meta['func_time'], status=status), mark_finished=mark_finished)
+        if self.cache is not None and status == "done" and "err" not in result:
+            self.add_to_cache(config, dirname, output, meta['func_time'])
+        return output
+
+    def count_written(self, dirs):
+        """
+            Count the runs in `dirs` handed to a writer which failed, and which were not written at all, e.g., as the manifest could not be written.
+            Writers of worker processes report their errors when the worker exits, the manifest tells how their runs finished.
+        """
+        manifest = load_manifest(self.output_dir)
+        statuses = Counter(manifest.get(edir, dict()).get('status') for edir in dirs)
+        return statuses["failed"], sum(n for status, n in statuses.items() if status not in FINISHED)
+
+    def attempts(self, config, meta):
+        """
+            The attempts to run the experiment of a config according to the retry policy of the runner, shared by `run_experiment` and `run_experiment_async`.
+            A generator yielding ("call", kwargs) for each attempt, to which the caller sends back the (result, status) of the experiment function
+            or throws the exception it raised, and ("sleep", seconds) before the next attempt.
+            It returns the final (result, status), the time spent in each phase of the last attempt is kept in `meta`.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            meta |= dict(attempts=attempt, make_kwargs_time=0.0, func_time=0.0)
+            phase, start = "make_kwargs_time", time.perf_counter()
+            try:
+                kwargs = self.make_kwargs(config)
+                meta[phase] = time.perf_counter() - start
+                phase, start = "func_time", time.perf_counter()
+                return (yield "call", kwargs)
+            except MemoryError as e:
+                return dict(err=str(traceback.format_exc())), "done"
+            except Exception as e:
+                delay = self.retry_delay(attempt, e)
+                if delay is None:
+                    # the batch goes on, the failed experiment can be run again with `only_failed`
+                    return dict(err=traceback.format_exc(), status="failed"), "failed"
+            finally:
+                meta[phase] = time.perf_counter() - start
+            yield "sleep", delay
+
+    def experiment_usage(self, before):
+        """
+            Cpu time and peak memory of the experiment which ran since `before`, a result of `rusage`, kept in its meta (see `resource_usage`)
+        """
+        return resource_usage(before)
+
+    def retry_delay(self, attempt, e):
+        """
+            Seconds to wait before trying an experiment again after its `attempt`-th attempt raised `e`, None if it should not be tried again
+        """
+        if attempt < self.max_attempts and isinstance(e, self.retry_on):
+            return self.retry_backoff * 2 ** (attempt - 1)
+        return None
+
+    def call_func(self, kwargs, profile_dir=None, run_dir=None):
+        """
+            Call the experiment function and return its result together with the status of the run.
+            If a timeout or cpu limit is set, the function runs in a forked process, which is killed when it exceeds them.
+            This keeps the worker alive, and a killed experiment gets an `err` and `status` ("timeout") in its result instead
+            If `profile_dir` is given, the function runs under the profiler of the runner and its profile is written there.
+            An experiment function defined with `async def` runs on its own event loop.
+            `run_dir` is the run directory of the experiment, for runners which write to it while the experiment runs (see `CommandRunner`).
+        """
+        func = self.func
+        if inspect.iscoroutinefunction(func):
+            func = lambda **kwargs: asyncio.run(self.func(**kwargs))
+
+        def run():
+            if profile_dir is None:
+                return func(**kwargs)
+            return profile_call(func, kwargs, self.profile, profile_dir)
+
+        if self.timeout is None and self.cpulimit <= 0:
+            return run(), "done"
+
+        read_fd, write_fd = os.pipe()
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0: # experiment process, should never return from here
+            try:
+                os.close(read_fd)
+                os.setpgid(0, 0) # own process group, so processes started by the experiment are killed too
+                if self.cpulimit > 0:
+                    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+                    resource.setrlimit(resource.RLIMIT_CPU, (self.cpulimit, hard))
+                try:
+                    try:
+                        data = pickle.dumps((True, run()), protocol=pickle.HIGHEST_PROTOCOL)
+                    except BaseException as e:
+                        data = pickle.dumps((False, (e, traceback.format_exc())), protocol=pickle.HIGHEST_PROTOCOL)
+                except BaseException as e: # result or error cannot be pickled
+                    data = pickle.dumps((False, (RuntimeError(str(e)), traceback.format_exc())))
+                with os.fdopen(write_fd, "wb") as f:
+                    f.write(data)
+            finally:
+                os._exit(0)
+
+        try: # also in the parent, so the group exists when the experiment is killed before the child got to it
+            os.setpgid(pid, pid)
+        except OSError: # the child is in its own group already, or exited
+            pass
+        os.close(write_fd)
+        chunks, timed_out = [], False
+        try:
+            while True: # keep reading, the experiment blocks when the pipe is full
+                remaining = None if self.timeout is None else start + self.timeout - time.monotonic()
+                if remaining is not None and (remaining <= 0 or len(select.select([read_fd], [], [], remaining)[0]) == 0):
+                    timed_out = True
+                    break
+                chunk = os.read(read_fd, 1 << 20)
+                if len(chunk) == 0: # experiment is done
+                    break
+                chunks.append(chunk)
+        except BaseException: # e.g., KeyboardInterrupt, which the experiment does not get in its own process group
+            timed_out = True
+            raise
+        finally:
+            os.close(read_fd)
+            if timed_out:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError: # not in its own group (yet), or finished just now
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+            _, exit_status = os.waitpid(pid, 0)
+        elapsed = time.monotonic() - start
+
+        if timed_out:
+            err = f"TimeoutError: experiment did not finish within {self.timeout} seconds"
+            return dict(err=err, status="timeout", elapsed=elapsed), "timeout"
+        if os.WIFSIGNALED(exit_status) and os.WTERMSIG(exit_status) == signal.SIGXCPU:
+            err = f"TimeoutError: experiment exceeded cpu limit of {self.cpulimit} seconds"
+            return dict(err=err, status="timeout", elapsed=elapsed), "timeout"
+        if len(chunks) == 0:
+            raise RuntimeError(f"Experiment process exited unexpectedly with status {exit_status}")
 
-        self.save_result(config, result, dirname)
+        success, value = pickle.loads(b"".join(chunks))
+        if success is True:
+            return value, "done"
+        e, tb = value
+        raise e from RemoteTraceback(tb)
 
     #####################################################
     #                   Helper functions                #
     #####################################################
 
+    def profiled(self, config):
+        """
+            Whether to profile the experiment of a config
+        """
+        if self.profile is None:
+            return False
+        return int(config_hash(config)[:8], 16) < self.profile_sample * 16 ** 8
+
+    def shared(self, config):
+        """
+            The objects shared by experiments with the same values for `shared_keys` as `config`, built by `prepare_shared`.
+            The objects of the `shared_cache_size` most recently used subsets are kept in each process,
+            in a parallel batch those of the first experiments are built in the main process before the workers are forked, so they get them for free (see `preload_shared`).
+            Objects built by a worker itself are only kept for its next experiments, so they are only reused when workers run several experiments (`tasks_per_child`).
+        """
+        subset = config_subset(config, self.shared_keys or [])
+        key = (type(self).__module__, type(self).__qualname__, config_hash(subset))
+        shared_objects.maxsize = self.shared_cache_size
+        return shared_objects.get(key, lambda: self.prepare_shared(subset))
+
+    def preload_shared(self, tasks, lookahead=SHARED_LOOKAHEAD):
+        """
+            Build the shared objects of the first `shared_cache_size` distinct subsets in the (config, index) tasks of a batch in this process,
+            before the workers are forked. At most `lookahead` tasks are taken from the iterator for this, they are returned.
+        """
+        first_tasks, subsets = [], set()
+        for config, idx in itertools.islice(tasks, lookahead):
+            first_tasks.append((config, idx))
+            subset = config_hash(config_subset(config, self.shared_keys or []))
+            if subset not in subsets:
+                subsets.add(subset)
+                self.shared(config)
+            if len(subsets) >= self.shared_cache_size:
+                break
+        return first_tasks
+
+    def lookup_cache(self, config):
+        """
+            The entry of a config in the result cache, None if there is no cache or the experiment did not run before.
+            Entries which do not have all results the result store mode of the runner needs are not used.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.lookup(self.cache.key(self.version, config), files=self.store != "only", row=self.store is not None)
+
+    def restore_result(self, config, entry, dirname, meta):
+        """
+            Put the results of a cache entry in `dirname` instead of running the experiment, and mark the run as finished like `save_result`.
+            Returns None if the entry cannot be restored, e.g., as another batch pruned it since it was looked up, the experiment should run instead.
+        """
+        save_start = time.perf_counter()
+        try:
+            artifacts = self.cache.restore(entry, dirname)
+        except OSError as e:
+            logging.warning(f"Could not restore {dirname} from the result cache, running it instead: {e}")
+            empty_dir(dirname)
+            return None
+        row = None if self.store is None else dict(entry['row'])
+        meta = meta | dict(cached=entry['key'], wall_time=entry['wall_time'], status="done")
+        return self.finish_run(config, dirname, artifacts, row, meta, save_start)
+
+    def add_to_cache(self, config, dirname, output, wall_time):
+        """
+            Add the results of a finished run to the result cache, `output` is the return value of `save_result`
+        """
+        exclude = (CONFIG, META, PROFILE_CPU, PROFILE_MEM, PROFILE_SNAPSHOT)
+        artifacts = natsorted(fname for fname in listdir(dirname) if fname not in exclude)
+        row = None
+        if self.store is not None: # meta differs for each run
+            row = {key: value for key, value in output[0].items() if key != "dir" and not key.startswith(f"{RESULT}/runexp_meta/")}
+        info = dict(version=self.version, config=dt_to_str_in_dict(config), wall_time=wall_time, files_complete=self.store != "only", row=row)
+        try:
+            self.cache.add(self.cache.key(self.version, config), dirname, artifacts, info)
+        except OSError as e: # the run itself is finished, it is just not cached
+            logging.warning(f"Could not add {dirname} to the result cache: {e}")
+
+    def cost_config(self, config):
+        """
+            The part of a config determining the cost of an experiment, the values of `cost_keys`,
+            or all values except seeds (see `SEED_KEYS`) if `cost_keys` is not set
+        """
+        flat = flat_dict(dt_to_str_in_dict(config))
+        if self.cost_keys is None:
+            return {key: value for key, value in flat.items() if not is_seed_key(key)}
+        return {key: flat.get(key) for key in self.cost_keys}
+
+    def check_cost_estimates(self, configs):
+        """
+            Warn when none of `configs` has the `cost_config` of a finished experiment, so the default `estimate_cost` cannot tell them apart
+        """
+        if type(self).estimate_cost is not Runner.estimate_cost or len(configs) == 0:
+            return
+        history, _ = self.cost_history
+        if len(history) and not any(config_hash(self.cost_config(config)) in history for config in configs):
+            logging.warning("No finished experiment has the same values for the cost keys as the remaining experiments, so they are not sorted, "
+                            "set `cost_keys` of the runner to the config keys determining the runtime of an experiment")
+
+    def load_cost_history(self):
+        """
+            Mean wall time of finished experiments in the output directory, per `cost_config`, and overall
+        """
+        times = dict()
+        for edir, record in load_manifest(self.output_dir).items():
+            if record['status'] not in ("done", "timeout") or "wall_time" not in record:
+                continue
+            with open(join(self.output_dir, edir, CONFIG), "r") as f:
+                key = config_hash(self.cost_config(json.loads(f.read())))
+            times.setdefault(key, []).append(record['wall_time'])
+
+        all_times = [t for lst in times.values() for t in lst]
+        default = sum(all_times) / len(all_times) if len(all_times) else 0
+        return {key: sum(lst) / len(lst) for key, lst in times.items()}, default
+
     def remove_empty_subdirs(self):
-        dirs =  listdir(self.output_dir)
+        dirs = [d for d in listdir(self.output_dir) if os.path.isdir(join(self.output_dir, d))]
         removed = 0
         pbar = tqdm(total=len(dirs))
         for edir in dirs:
             full_dir = join(self.output_dir, edir)
             if len(listdir(full_dir)) == 0:
                 os.rmdir(full_dir)
+                append_manifest(self.output_dir, dict(dir=edir, status="removed"))
                 removed += 1
                 pbar.set_description(f"Removed {removed} dirs")
             pbar.update()
@@ -151,80 +922,177 @@ class Runner:
         """
             Filter experiments already finished in output directory
         """
-        str_filtered = [dt_to_str_in_dict(c) for c in configs]
-        filtered = copy.copy(configs)
-        for edir in listdir(self.output_dir):
-            full_dir = join(self.output_dir, edir)
-            if os.path.isdir(full_dir):
-                # robustify the code to some dummy files, e.g .DS_Store
-                if CONFIG not in listdir(full_dir):
-                    if len(listdir(full_dir)) != 0:
-                        raise ValueError(f"{full_dir} is not emptpy, but does not contain {CONFIG}, was the directory created by RunExp?")
-                    else:
-                        continue
-                with open(join(self.output_dir, edir, CONFIG), "r") as f:
-                    disk_conf = json.loads(f.read())
-                    if disk_conf in str_filtered:
-                        idx = str_filtered.index(disk_conf)
-                        filtered.pop(idx)
-                        str_filtered.pop(idx)
-
-        return filtered
-
-
-    def mkdir(self):
-        global dirlock
-        with dirlock:
-            idx = self.next_emtpy_index()
+        return list(self.iter_filter_experiments(configs))
+
+    def iter_filter_experiments(self, configs):
+        """
+            Lazily filter experiments already finished in output directory.
+            Finished experiments are read from the manifest and matched to planned configs on their `config_hash`,
+            so this runs in O(N+M). The number of skipped experiments is kept in `self.n_skipped`
+        """
+        finished = Counter(record['hash'] for record in load_manifest(self.output_dir).values()
+                           if record['status'] in FINISHED)
+
+        self.n_skipped = 0
+        for config in configs:
+            key = config_hash(config)
+            if finished[key] > 0: # already on disk
+                finished[key] -= 1
+                self.n_skipped += 1
+            else:
+                yield config
+
+
+    def iter_failed_experiments(self, configs):
+        """
+            Lazily select the experiments which failed before, yields each config together with the index of its failed run directory,
+            which is emptied so the experiment can run in it again.
+            Failed runs are matched to `configs` on their `config_hash`, so a shard reruns the failed runs of its own slice of the batch,
+            wherever they ran before.
+            All other experiments are counted in `self.n_skipped`
+        """
+        failed = dict()
+        for edir, record in natsorted(load_manifest(self.output_dir).items()):
+            if record['status'] != "failed" or not edir.isdigit():
+                continue
+            failed.setdefault(record['hash'], []).append(edir)
+
+        self.n_skipped = 0
+        for config in configs:
+            dirs = failed.get(config_hash(config))
+            if not dirs:
+                self.n_skipped += 1
+                continue
+            edir = dirs.pop(0)
+            empty_dir(join(self.output_dir, edir))
+            yield config, int(edir)
+
+    def mkdir(self, idx=None):
+        """
+            Make the output directory with index `idx`, reserved by the caller using `free_indices`.
+            If no index is given, the next empty index is searched for in the manifest.
+        """
+        with self.dirlock:
+            if idx is None:
+                idx = self.next_emtpy_index()
             # make dir for results
             dirname = (self.digits - len(str(idx))) * "0" + str(idx)
             full_dir = join(self.output_dir, dirname)
             try:
                 os.mkdir(full_dir)
             except FileExistsError:
-                print(len(full_dir))
                 assert len(listdir(full_dir)) == 0, f"{full_dir} should be empty"
-                pass
+            append_manifest(self.output_dir, dict(dir=dirname, status="running", start=timestamp(), pid=os.getpid()), self.manifest_name())
             return full_dir
 
-    def next_emtpy_index(self):
+    def free_indices(self):
         """
             RunExp creates output directories with numeric names.
-            This function finds the next directory name
-        """
-        last_idx = 0
-        for edir in sorted(listdir(self.output_dir)):
-            if os.path.isdir(os.path.join(self.output_dir, edir)):
-                # THis condition make the code robust to some files that your os can generate (like .DS_store..)
-                idx = int(edir)
-                if idx - 1 != last_idx:  # some missing number in the chain
-                    return last_idx + 1
-                # if len(listdir(join(self.output_dir, edir))) == 0:  # found empty dir
-                #     return idx
-                last_idx = idx
-        return last_idx + 1
-
-    def save_result(self, config, result, dirname):
-
-        with open(join(dirname, CONFIG), "w") as f:
-            f.write(json.dumps(dt_to_str_in_dict(config)))
+            This generator yields all indices not yet used in the manifest, filling up missing numbers in the chain first.
+            The manifest is only read once, so each next index is found in O(1).
+            When running shard i of n, only indices equal to i modulo n are used, so shards never collide
+        """
+        used = {int(edir) for edir, record in load_manifest(self.output_dir).items()
+                if edir.isdigit() and record['status'] != "removed"}
+        idx, step = (1, 1) if self.shard is None else self.shard
+        while True:
+            if idx not in used:
+                yield idx
+            idx += step
+
+    def manifest_name(self):
+        return MANIFEST if self.shard is None else SHARD_MANIFEST.format(self.shard[0])
+
+    def store_name(self):
+        return STORE if self.shard is None else SHARD_STORE.format(self.shard[0])
+
+    def status_name(self):
+        return STATUS if self.shard is None else SHARD_STATUS.format(self.shard[0])
 
+    def next_emtpy_index(self):
+        """
+            Find the next directory name, i.e., the first number not yet used in the manifest
+        """
+        return next(self.free_indices())
+
+    def save_result(self, config, result, dirname, meta=None, mark_finished=True):
+        """
+            Write each artifact in the result and the config to `dirname` and mark the run as finished in the manifest.
+            The config is written last, so a run directory with a config has all its artifacts.
+            `meta` holds information on how the experiment ran (see `run_experiment`), written to `runexp_meta.json` together with the time it took to save the result.
+            Its `status` and `wall_time` are also put in the manifest record of the run.
+            Returns the manifest record of the run.
+            When using a result store, returns the row for the store and the manifest record instead,
+            the run is marked as finished once the row is written (see `store_results`).
+            Without `mark_finished`, the manifest record is not appended, to mark several runs as finished at once.
+        """
+        save_start = time.perf_counter()
+
+        row, stored = None, []
+        if self.store is not None:
+            row, stored = store_row(config, result)
+            if self.store == "both":
+                stored = []
+
+        artifacts = []
         for key, value in result.items():
+            if key in stored: # only in the result store
+                continue
+
             if "." in str(key): # will assume extension is given
-                with open(join(dirname, str(key)), "w") as f:
-                    f.write(str(value))
+                fname = str(key)
+                serializer = get_serializer(fname)
+                if serializer is not None and not serializer.accepts(value): # e.g., already formatted
+                    serializer = None
+            else:
+                serializer = find_serializer(value)
+                fname = str(key) + serializer.ext
 
-            elif can_stringify(value):
-                with open(join(dirname, str(key) + ".txt"), "w") as f:
+            if self.compression is not None and not isinstance(value, (int, float)) and key not in UNCOMPRESSED:
+                fname += COMPRESSIONS[self.compression]
+            if serializer is None:
+                with open_file(join(dirname, fname), "w") as f:
                     f.write(str(value))
+            else:
+                serializer.save_to_file(value, join(dirname, fname))
+            artifacts.append(fname)
+
+        return self.finish_run(config, dirname, artifacts, row, meta, save_start, mark_finished)
+
+    def finish_run(self, config, dirname, artifacts, row=None, meta=None, save_start=None, mark_finished=True):
+        """
+            Write the meta and the config of a run whose artifacts are saved, and mark it as finished in the manifest, see `save_result`
+        """
+        end = timestamp() # also in the meta, so a rebuilt manifest has the same end time (see `rebuild_manifest`)
+        if meta is not None:
+            save_time = 0.0 if save_start is None else time.perf_counter() - save_start
+            meta = meta | dict(save_time=save_time, end=end)
+            with open(join(dirname, META), "w") as f:
+                f.write(json.dumps(meta))
+            artifacts.append(META)
+        # the config marks the run directory as finished (see `rebuild_manifest`), so it is written at once when results are written asynchronously
+        with staged_path(join(dirname, CONFIG), atomic=self.async_writes) as path, open(path, "w") as f:
+            f.write(json.dumps(dt_to_str_in_dict(config)))
+
+        record = dict(dir=os.path.basename(os.path.normpath(dirname)), hash=config_hash(config),
+                      status="done", end=end, artifacts=artifacts)
+        record |= {key: meta[key] for key in ("status", "wall_time") if key in (meta or dict())}
+        if self.store is not None:
+            if meta is not None:
+                row |= flat_dict({RESULT: {"runexp_meta": meta}})
+            return row | dict(dir=record['dir']), record
+        if not mark_finished:
+            return record
 
-            elif isinstance(value, dict) and can_write_to_json(value):
-                with open(join(dirname, str(key) + ".json"), "w") as f:
-                    f.write(json.dumps(value))
+        # only mark the run as finished once all artifacts are on disk
+        with self.dirlock:
+            append_manifest(self.output_dir, record, self.manifest_name())
+        return record
 
-            elif isinstance(value, (list, set, tuple)) and all(can_stringify(v) for v in value):
-                with open(join(dirname, str(key) + ".lst"), "w") as f:
-                    f.write("\n".join([str(v) for v in value]))
-            else:  # save as pickle
-                with open(join(dirname, str(key) + ".pickle"), "wb") as f:
-                    pickle.dump(value, f)
+    def store_results(self, store, outputs):
+        """
+            Write the rows of finished runs to the result store, and only then mark the runs as finished in the manifest
+        """
+        store.append([row for row, _ in outputs])
+        with self.dirlock:
+            extend_manifest(self.output_dir, [record for _, record in outputs], self.manifest_name())
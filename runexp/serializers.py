@@ -0,0 +1,212 @@
+import ast
+import gzip
+import importlib.util
+import json
+import lzma
+import os
+import pickle
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from .utils import can_stringify, can_write_to_json
+
+BINARY_LIST_MIN = 1024 # lists of numbers at least this long are written in binary instead of as a `.lst` file
+COMPRESSIONS = {"gzip": ".gz", "lzma": ".xz", "zstd": ".zst"} # extension added to compressed artifacts
+LIST_EXTS = (".lst", ".arr") # a list is written to either depending on its length, so runs of a batch may differ in the extension of the same key
+
+# Each artifact of a run is written by the first serializer accepting its value, to a file with the extension of the serializer.
+# Loading a file dispatches on its extension through the same registry.
+# Serializers registered by users are tried before the built-in ones, the last one accepts anything (pickle).
+
+class Serializer:
+    """
+        Writes and reads one type of artifact to a file with extension `ext`.
+        `dump(value, f)` writes the value to an open file, `load(f)` reads it back,
+        `accepts(value)` tells whether the value can be written by this serializer.
+        Files are opened in binary mode if `binary` is True, in text mode otherwise.
+        If given, `mmap(fname)` reads an uncompressed file memory-mapped, used when loading results lazily.
+    """
+    def __init__(self, ext, dump, load, accepts, binary=False, mmap=None):
+        self.ext = ext if ext.startswith(".") else "." + ext
+        self.dump, self.load, self.accepts, self.binary, self.mmap = dump, load, accepts, binary, mmap
+
+    def save_to_file(self, value, fname):
+        """
+            Write the value to `fname`, compressed if `fname` ends with the extension of a compression
+        """
+        with open_file(fname, "wb" if self.binary else "w") as f:
+            self.dump(value, f)
+
+    def load_from_file(self, fname):
+        with open_file(fname, "rb" if self.binary else "r") as f:
+            return self.load(f)
+
+
+def _zstd():
+    try:
+        from compression import zstd # python 3.14+
+        return zstd
+    except ImportError:
+        import zstandard # pip install zstandard
+        return zstandard
+
+def check_compression(compression):
+    """
+        Raise an error if artifacts cannot be written with `compression`
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, should be None or one of {list(COMPRESSIONS)}")
+    if compression == "zstd":
+        _zstd()
+
+def open_file(fname, mode):
+    """
+        Open a file, (de)compressing it on the fly if it ends with the extension of a compression.
+        Data is compressed while it is written, so it is never held in memory as a whole.
+    """
+    if fname.endswith(COMPRESSIONS["gzip"]):
+        return gzip.open(fname, mode + ("t" if "b" not in mode else ""))
+    if fname.endswith(COMPRESSIONS["lzma"]):
+        return lzma.open(fname, mode + ("t" if "b" not in mode else ""))
+    if fname.endswith(COMPRESSIONS["zstd"]):
+        return _zstd().open(fname, mode + ("t" if "b" not in mode else ""))
+    return open(fname, mode)
+
+def is_compressed(fname):
+    return any(fname.endswith(ext) for ext in COMPRESSIONS.values())
+
+def find_file(fname):
+    """
+        Name of the file on disk for an artifact, which may have been written compressed.
+        A list artifact is found under any of the `LIST_EXTS`, e.g., `trace.arr` when asking for `trace.lst`.
+        Raises FileNotFoundError if there is no (compressed) variant of the file.
+    """
+    base, ext = os.path.splitext(fname)
+    candidates = [fname]
+    if ext in LIST_EXTS:
+        candidates += [base + other for other in LIST_EXTS if other != ext]
+    for candidate in candidates:
+        for compression in ("",) + tuple(COMPRESSIONS.values()):
+            if os.path.exists(candidate + compression):
+                return candidate + compression
+    raise FileNotFoundError(f"No such file: {fname}")
+
+
+_serializers = [] # in order they are tried when saving
+_by_ext = dict()
+_replaced = dict() # extension -> stack of (position, serializer) replaced by each registration, restored by `unregister_serializer`
+
+def register_serializer(ext, dump, load, accepts, binary=False, mmap=None):
+    """
+        Register a serializer for artifacts with extension `ext`, tried before all serializers registered earlier.
+        `accepts` is either a type (or tuple of types) or a function telling whether a value should be written by it.
+        E.g., `register_serializer(".npz", my_dump, my_load, MySparseMatrix, binary=True)`
+    """
+    if isinstance(accepts, (type, tuple)):
+        types = accepts
+        accepts = lambda value: isinstance(value, types)
+    serializer = Serializer(ext, dump, load, accepts, binary, mmap)
+    _replaced.setdefault(serializer.ext, []).append([(i, s) for i, s in enumerate(_serializers) if s.ext == serializer.ext])
+    _serializers[:] = [s for s in _serializers if s.ext != serializer.ext]
+    _serializers.insert(0, serializer)
+    _by_ext[serializer.ext] = serializer
+    return serializer
+
+def unregister_serializer(ext):
+    """
+        Remove the serializer registered last for `ext`, the serializer it replaced (if any) is used again
+    """
+    ext = ext if ext.startswith(".") else "." + ext
+    if len(_replaced.get(ext, [])) == 0:
+        raise KeyError(f"No serializer registered for {ext}")
+    _serializers[:] = [s for s in _serializers if s.ext != ext]
+    _by_ext.pop(ext, None)
+    for i, serializer in _replaced[ext].pop():
+        _serializers.insert(i, serializer)
+        _by_ext[ext] = serializer
+
+def find_serializer(value):
+    """
+        Serializer to write a value with
+    """
+    for serializer in _serializers:
+        if serializer.accepts(value):
+            return serializer
+    raise ValueError(f"No serializer for value of type {type(value)}")
+
+def get_serializer(fname):
+    """
+        Serializer for a file, based on its extension. Returns None for unknown extensions.
+    """
+    base = fname.split("/")[-1]
+    for ext in COMPRESSIONS.values():
+        base = base.removesuffix(ext)
+    return _by_ext.get(base[base.rfind("."):]) if "." in base else None
+
+
+###########################
+#   Built-in serializers  #
+###########################
+
+def _load_txt(f):
+    str_val = f.read()
+    try:
+        return ast.literal_eval(str_val)
+    except (ValueError, SyntaxError):
+        return str_val
+
+def _dump_lst(value, f):
+    for i, v in enumerate(value):
+        f.write(("\n" if i else "") + str(v))
+
+def _load_lst(f):
+    res = []
+    for l in f:
+        l = l.strip()
+        try:
+            res.append(ast.literal_eval(l))
+        except (ValueError, SyntaxError):
+            res.append(l)
+    return res
+
+def _load_json(f):
+    txt = f.read()
+    return json.loads(txt) if len(txt) else dict()
+
+def _is_binary_list(value):
+    # long lists of only ints fitting in 64 bits, or only floats
+    if not isinstance(value, (list, tuple)) or len(value) < BINARY_LIST_MIN:
+        return False
+    if all(type(v) is float for v in value):
+        return True
+    return all(type(v) is int for v in value) and -2**63 <= min(value) and max(value) < 2**63
+
+def _dump_binary_list(value, f):
+    typecode = "d" if type(value[0]) is float else "q"
+    f.write(typecode.encode("ascii"))
+    array(typecode, value).tofile(f)
+
+def _load_binary_list(f):
+    values = array(f.read(1).decode("ascii"))
+    values.frombytes(f.read())
+    return values.tolist()
+
+def _dump_pickle(value, f):
+    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+register_serializer(".pickle", _dump_pickle, pickle.load, lambda value: True, binary=True)
+register_serializer(".lst", _dump_lst, _load_lst,
+                    lambda value: isinstance(value, (list, set, tuple)) and all(can_stringify(v) for v in value))
+register_serializer(".arr", _dump_binary_list, _load_binary_list, _is_binary_list, binary=True)
+if importlib.util.find_spec("pyarrow") is not None or importlib.util.find_spec("fastparquet") is not None:
+    register_serializer(".parquet", lambda value, f: value.to_parquet(f), pd.read_parquet,
+                        lambda value: isinstance(value, pd.DataFrame) and all(isinstance(c, str) for c in value.columns),
+                        binary=True)
+register_serializer(".npy", lambda value, f: np.save(f, value, allow_pickle=False), np.load,
+                    lambda value: isinstance(value, np.ndarray) and not value.dtype.hasobject, binary=True,
+                    mmap=lambda fname: np.load(fname, mmap_mode="r"))
+register_serializer(".json", json.dump, _load_json,
+                    lambda value: isinstance(value, dict) and can_write_to_json(value))
+register_serializer(".txt", lambda value, f: f.write(str(value)), _load_txt, can_stringify)
@@ -0,0 +1,92 @@
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+from .utils import config_hash
+
+SHARED_CACHE_SIZE = 8 # number of shared objects kept per process
+SHARED_LOOKAHEAD = 10000 # experiments of a parallel batch searched for distinct shared objects to build before the workers are forked
+
+# Objects shared by many experiments, e.g., a big dataset used by all seeds, are built once per process and kept in an LRU cache.
+# Caches live at module level: workers are forked from the main process, so they start with everything the main process built (copy-on-write),
+# and they keep what they build themselves for their next experiments.
+
+class LRUCache:
+    """
+        Keeps the `maxsize` most recently used values, safe to use from multiple threads
+    """
+    def __init__(self, maxsize=SHARED_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_lock) # another thread may hold the lock while forking
+
+    def _reset_lock(self):
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+            Value of `key`, built using `build()` if it is not in the cache
+        """
+        with self.lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                return self.values[key]
+        value = build() # not holding the lock, so other keys can be built at the same time
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > max(0, self.maxsize):
+                self.values.popitem(last=False)
+        return value
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+shared_objects = LRUCache() # objects built by `Runner.prepare_shared`
+
+def config_subset(config, keys):
+    """
+        Part of a config with the values of `keys`, flattened keys such as "data/name" select nested values
+    """
+    subset = dict()
+    for key in keys:
+        value = config
+        for part in key.split("/"):
+            value = value.get(part) if isinstance(value, dict) else None
+        subset[key] = value
+    return subset
+
+
+def memoize(keys=None, maxsize=SHARED_CACHE_SIZE):
+    """
+        Decorator memoizing a function of a config on the values of `keys` in the config (the whole config if None),
+        keeping the results for the `maxsize` most recently used values in each process.
+        The config is the last argument, so it can decorate methods of a `Runner` as well, e.g.,
+
+            @memoize(keys=["dataset"], maxsize=2)
+            def load_dataset(self, config):
+                return load(config["dataset"])
+
+        The result should only depend on the values of `keys`.
+    """
+    def decorator(func):
+        cache = LRUCache(maxsize)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            config = args[-1]
+            key = config_hash(config if keys is None else config_subset(config, keys))
+            return cache.get(key, lambda: func(*args))
+        wrapper.cache = cache
+        return wrapper
+    return decorator
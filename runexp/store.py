@@ -0,0 +1,109 @@
+import glob
+import json
+import sqlite3
+from contextlib import closing
+from os.path import join
+
+import pandas as pd
+from natsort import natsorted
+
+from .utils import can_stringify, can_write_to_json, flat_dict, dt_to_str_in_dict
+
+STORE = "results.sqlite"
+SHARD_STORE = "results.shard{}.sqlite" # like manifests, each shard of a batch writes to its own store
+TABLE = "results"
+STORE_BATCH = 256 # number of rows written to the store at once
+RESULT = "result" # prefix of the columns of results in the store
+
+# Rows in the store have a column "config/<key>" for each key of the flattened config,
+# and "result/<key>/<key>" for scalar results and "result/<key>/<subkey>" for dict results, so a result named "config" never collides with the config.
+# `read_store` drops the "result/" prefix, giving the same columns as `results_to_df` reading files would.
+# Values sqlite has no type for (e.g., bools and lists in the config) are written as json in a blob, which tells them apart from strings when reading.
+
+def store_row(config, result):
+    """
+        Make a row for the result store from a config and the result of its experiment.
+        Returns the row and the keys of the result that are in it, other results can only be written to files.
+    """
+    row = flat_dict({"config": dt_to_str_in_dict(config)})
+    stored = []
+    for key, value in result.items():
+        if "." in str(key): # explicit file
+            continue
+        if can_stringify(value):
+            row[f"{RESULT}/{key}/{key}"] = value
+            stored.append(key)
+        elif isinstance(value, dict) and can_write_to_json(value):
+            flat = flat_dict({RESULT: {str(key): value}})
+            if all(can_stringify(v) for v in flat.values()):
+                row.update(flat)
+                stored.append(key)
+    return row, stored
+
+def _to_cell(val):
+    if val is None or (can_stringify(val) and not isinstance(val, bool)):
+        return val
+    return json.dumps(val).encode("utf-8")
+
+def _from_cell(val):
+    return json.loads(val) if isinstance(val, bytes) else val
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ResultStore:
+    """
+        SQLite table in the output directory with a row per finished run, keyed by the name of its directory.
+        Only the process running the batch writes to it.
+    """
+
+    def __init__(self, output_dir, fname=STORE):
+        self.conn = sqlite3.connect(join(output_dir, fname))
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (dir TEXT PRIMARY KEY)")
+        self.columns = {info[1] for info in self.conn.execute(f"PRAGMA table_info({TABLE})")}
+
+    def append(self, rows):
+        """
+            Insert or replace rows (dicts with a "dir" key) in one transaction
+        """
+        with self.conn:
+            for row in rows:
+                for column in [c for c in row if c not in self.columns]: # new columns are added on the fly
+                    self.conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {_quote(column)}")
+                    self.columns.add(column)
+                columns = list(row.keys())
+                self.conn.execute(f"INSERT OR REPLACE INTO {TABLE} ({', '.join(map(_quote, columns))}) "
+                                  f"VALUES ({', '.join('?' * len(columns))})", [_to_cell(row[c]) for c in columns])
+
+    def close(self):
+        self.conn.close()
+
+
+def store_files(dirname):
+    """
+        All result stores in an output directory, the main one first
+    """
+    shards = natsorted(glob.glob(join(glob.escape(dirname), SHARD_STORE.format("*"))))
+    return glob.glob(join(glob.escape(dirname), STORE)) + shards
+
+def read_store(dirname, attrs):
+    """
+        Read the config and the columns of the results in `attrs` from all result stores in `dirname`.
+        Only the requested columns are read from disk.
+        Returns a dataframe indexed by run directory, and the attributes found in the stores.
+    """
+    frames, found = [], set()
+    for fname in store_files(dirname):
+        with closing(sqlite3.connect(fname)) as conn:
+            columns = [info[1] for info in conn.execute(f"PRAGMA table_info({TABLE})")]
+            results = [c for c in columns if c.startswith(RESULT + "/")]
+            found |= {c.split("/")[1] for c in results}
+            selected = ["dir"] + [c for c in columns if c.startswith("config/")] + [c for c in results if c.split("/")[1] in attrs]
+            frames.append(pd.read_sql_query(f"SELECT {', '.join(map(_quote, selected))} FROM {TABLE}", conn, index_col="dir"))
+    if len(frames) == 0:
+        return pd.DataFrame(), found
+    df = pd.concat(frames)
+    df = df.apply(lambda column: column.map(_from_cell) if column.dtype == object else column).infer_objects()
+    df.columns = [c[len(RESULT) + 1:] if c.startswith(RESULT + "/") else c for c in df.columns]
+    return df, found
@@ -0,0 +1,200 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join
+
+from .utils import dt_to_str_in_dict, timestamp, FINISHED
+
+STATUS = "status.json"
+SHARD_STATUS = "status.shard{}.json"
+STATUS_INTERVAL = 10 # seconds between updates of the status file
+SLOWEST = 5 # number of slowest running experiments in the status
+
+# Live status of a running batch, kept up to date by following the manifest the batch appends to:
+# "running" records tell which worker (pid) started which run directory, later records tell when and how it finished.
+# The status is written to a json file in the output directory and can be served over http.
+
+class Telemetry:
+    """
+        Tracks the progress of a batch of `total` experiments run by `runner`,
+        writes its status to `fname` in the output directory every `interval` seconds,
+        and serves it on http://127.0.0.1:`port` if a port is given (0 for any free port).
+        If a progress bar is given, its description shows the longest running experiment.
+        With `by_cost`, the remaining time is estimated using `runner.estimate_cost` of each experiment, otherwise all experiments count the same.
+    """
+
+    def __init__(self, runner, total, fname=STATUS, interval=STATUS_INTERVAL, port=None, pbar=None, by_cost=False):
+        self.runner = runner
+        self.total = total
+        self.fname = join(runner.output_dir, fname)
+        self.interval = interval
+        self.port = port
+        self.pbar = pbar
+        self.by_cost = by_cost
+
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.started = timestamp()
+        self.planned = dict() # run directory -> (config, estimated cost) for experiments handed out to workers
+        self.runs = dict() # run directory -> latest manifest record
+        self.finished_cost = 0.0
+
+        manifest = join(runner.output_dir, runner.manifest_name())
+        self.manifest = manifest
+        self.offset = os.path.getsize(manifest) if os.path.exists(manifest) else 0
+        self.partial = b""
+        self.poll_lock = threading.Lock() # status is read by the writer and the http server
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def track(self, tasks):
+        """
+            Pass through the (config, index) tasks of the batch, remembering the config handed out for each run directory
+        """
+        for config, idx in tasks:
+            dirname = (self.runner.digits - len(str(idx))) * "0" + str(idx)
+            cost = self.runner.estimate_cost(config) if self.by_cost else 1.0
+            with self.lock:
+                self.planned[dirname] = (config, cost)
+            yield config, idx
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        if self.port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), _handler(self))
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Serving the status of the batch on http://127.0.0.1:{self.server.server_address[1]}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.write()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            status = self.write()
+            if self.pbar is not None and len(status['slowest_running']):
+                self.pbar.set_description(status['slowest_running'][0].get('description', status['slowest_running'][0]['dir']))
+
+    def update(self, record):
+        """
+            Process a manifest record of this batch, e.g., a run which was started or finished
+        """
+        with self.lock:
+            previous = self.runs.get(record['dir'], dict())
+            if previous.get('status') in FINISHED: # already known, e.g., from the result store
+                return
+            self.runs[record['dir']] = previous | record
+            if record['status'] in FINISHED and record['dir'] in self.planned:
+                self.finished_cost += self.planned[record['dir']][1]
+
+    def poll(self):
+        """
+            Read the records appended to the manifest since the last poll
+        """
+        if not os.path.exists(self.manifest):
+            return
+        with self.poll_lock:
+            with open(self.manifest, "rb") as f:
+                f.seek(self.offset)
+                data = self.partial + f.read()
+                self.offset = f.tell()
+            *lines, self.partial = data.split(b"\n")
+        for line in lines:
+            if len(line):
+                self.update(json.loads(line))
+
+    def status(self):
+        """
+            Current status of the batch as a json-able dict
+        """
+        self.poll()
+        now, elapsed = time.time(), time.time() - self.start_time
+        with self.lock:
+            statuses = dict()
+            for record in self.runs.values():
+                statuses[record['status']] = statuses.get(record['status'], 0) + 1
+            n_finished = sum(statuses.get(status, 0) for status in FINISHED)
+            running = [record for record in self.runs.values() if record['status'] == "running"]
+
+            # time each worker spent on experiments of this batch
+            workers = dict()
+            for record in self.runs.values():
+                if "pid" not in record or "start" not in record:
+                    continue
+                worker = workers.setdefault(record['pid'], dict(busy=0.0, finished=0, running=None))
+                start = datetime.fromisoformat(record['start']).timestamp()
+                if record['status'] == "running":
+                    worker['busy'] += now - start
+                    worker['running'] = record['dir']
+                elif "end" in record:
+                    worker['busy'] += datetime.fromisoformat(record['end']).timestamp() - start
+                    worker['finished'] += 1
+            for worker in workers.values():
+                worker['busy_fraction'] = min(1.0, worker.pop('busy') / elapsed) if elapsed > 0 else 0.0
+
+            slowest = sorted(running, key=lambda record: record['start'])[:SLOWEST]
+            slowest = [self._describe(record, now) for record in slowest]
+
+            # the experiments not handed out yet are assumed to cost as much as the ones which were
+            n_remaining = max(0, self.total - self.runner.n_skipped - n_finished)
+            costs = [cost for _, cost in self.planned.values()]
+            mean_cost = sum(costs) / len(costs) if len(costs) else 1.0
+            remaining_cost = sum(cost for edir, (_, cost) in self.planned.items()
+                                 if self.runs.get(edir, dict()).get('status') not in FINISHED)
+            remaining_cost += mean_cost * max(0, n_remaining - (len(self.planned) - n_finished))
+
+        eta = None
+        if self.finished_cost > 0 and elapsed > 0:
+            eta = remaining_cost / (self.finished_cost / elapsed)
+        elif n_finished > 0 and elapsed > 0: # no cost estimates yet
+            eta = n_remaining / (n_finished / elapsed)
+        return dict(started=self.started, updated=timestamp(), elapsed=elapsed, host=socket.gethostname(),
+                    total=self.total, skipped=self.runner.n_skipped, finished=n_finished, running=len(running),
+                    failed=statuses.get("failed", 0), timeout=statuses.get("timeout", 0), remaining=n_remaining, statuses=statuses,
+                    per_minute=60 * n_finished / elapsed if elapsed > 0 else 0.0, eta=eta,
+                    workers={str(pid): worker for pid, worker in workers.items()}, slowest_running=slowest)
+
+    def _describe(self, record, now):
+        description = dict(dir=record['dir'], elapsed=now - datetime.fromisoformat(record['start']).timestamp(), pid=record.get('pid'))
+        if record['dir'] in self.planned:
+            config, cost = self.planned[record['dir']]
+            description |= dict(description=self.runner.description(config), estimated_cost=cost, config=dt_to_str_in_dict(config))
+        return description
+
+    def write(self):
+        """
+            Write the status to the status file, replacing it at once so readers never see a partial file
+        """
+        status = self.status()
+        tmp_name = f"{self.fname}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(tmp_name, "w") as f:
+            f.write(json.dumps(status, default=str))
+        os.replace(tmp_name, self.fname)
+        return status
+
+
+def _handler(telemetry):
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(telemetry.status(), default=str).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): # do not clutter the progress bar
+            pass
+    return StatusHandler
@@ -1,19 +1,29 @@
+import bisect
 import glob
-import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 from datetime import datetime, timedelta, date
 from json import JSONDecodeError
 from os.path import join
 from os import listdir
 import pickle
 import json
+import hashlib
+import socket
 
+import numpy as np
 import pandas as pd
 from tqdm.auto import tqdm
 from natsort import natsorted # pip install natsort
 import os
-dirlock = multiprocessing.Lock()
 
 CONFIG = "config.json"
+META = "runexp_meta.json" # how the experiment of a run ran, e.g., its cpu time and peak memory
+MANIFEST = "manifest.jsonl"
+FINISHED = ("done", "timeout", "failed") # status of runs which should not run again, failed runs only run again when asked for
+SHARD_MANIFEST = "manifest.shard{}.jsonl" # each shard of a batch appends to its own manifest
+RESULTS_CACHE = "results_cache.pickle"
+EAGER = (".txt", ".json") # artifacts which are small and flattened into columns, also loaded right away when loading lazily
 STRFTIME = "%Y-%m-%d %H:%M:%S"
 
 MAGIC_DT = "_dt" # which magic seqence a datetime value should end with
@@ -42,7 +52,115 @@ def can_write_to_json(val):
 ###########################
 
 def unravel_dict(root_d, _dt=False, _td=False):
-    new_dicts = [dict()]
+    return list(iter_unravel(root_d, _dt=_dt, _td=_td))
+
+def iter_unravel(root_d, start=None, stop=None, _dt=False, _td=False):
+    """
+        Lazy variant of `unravel_dict`, yields the unraveled configs one by one in the same order.
+        If `start` or `stop` is given, only yields the configs in that slice, without expanding the ones before.
+    """
+    space = _unravel_space(root_d, _dt=_dt, _td=_td)
+    if start is None and stop is None:
+        yield from space
+    else:
+        for i in range(*slice(start, stop).indices(len(space))):
+            yield space[i]
+
+def count_unravel(root_d, _dt=False, _td=False):
+    """
+        Number of configs `unravel_dict` would produce, computed without expanding them.
+    """
+    return len(_unravel_space(root_d, _dt=_dt, _td=_td))
+
+def unravel_at(root_d, index, _dt=False, _td=False):
+    """
+        Config at position `index` in the output of `unravel_dict`, computed without expanding the other configs.
+        If `index` is a slice, returns the list of configs in that slice.
+    """
+    space = _unravel_space(root_d, _dt=_dt, _td=_td)
+    if isinstance(index, slice):
+        return [space[i] for i in range(*index.indices(len(space)))]
+    if index < 0:
+        index += len(space)
+    if not 0 <= index < len(space):
+        raise IndexError(f"Config index {index} out of range for {len(space)} configs")
+    return space[index]
+
+
+# Unraveling a config builds a tree of "spaces", each knowing its size without expanding it:
+#   - _Values: a sequence of values, e.g., a range or the files matching a glob pattern
+#   - _Concat: the configs of each sub-space after one another, from unraveling a list
+#   - _Product: the cartesian product of the sub-spaces of each key in a dict, the first key varies fastest
+# Indexing a space decodes the index into an index of each sub-space, mixed-radix style for products.
+
+class _Values:
+    def __init__(self, values):
+        self.values = values
+        self.size = len(values)
+    def __len__(self):
+        return self.size
+    def __iter__(self):
+        return iter(self.values)
+    def __getitem__(self, idx):
+        return self.values[idx]
+
+class _Concat:
+    def __init__(self, spaces):
+        self.spaces = spaces
+        self.offsets = list(itertools.accumulate((len(space) for space in spaces), initial=0))
+        self.size = self.offsets[-1]
+    def __len__(self):
+        return self.size
+    def __iter__(self):
+        for space in self.spaces:
+            yield from space
+    def __getitem__(self, idx):
+        i = bisect.bisect_right(self.offsets, idx) - 1
+        return self.spaces[i][idx - self.offsets[i]]
+
+class _Product:
+    def __init__(self, items):
+        self.items = items # list of (key, space)
+        self.size = 1
+        for _, space in self.items:
+            self.size *= len(space)
+    def __len__(self):
+        return self.size
+    def __iter__(self):
+        return self._iter(len(self.items))
+    def _iter(self, n):
+        # product of the first n keys, the last of which varies slowest
+        if n == 0:
+            yield dict()
+            return
+        key, space = self.items[n-1]
+        for val in space:
+            for d in self._iter(n-1):
+                yield d | {key: val}
+    def __getitem__(self, idx):
+        d = dict()
+        for key, space in self.items:
+            idx, digit = divmod(idx, len(space))
+            d[key] = space[digit]
+        return d
+
+class _DtRange:
+    """
+        Range of datetimes from `start` to `end` (exclusive) with step `step`
+    """
+    def __init__(self, start, end, step):
+        self.start, self.end, self.step = start, end, step
+    def __len__(self):
+        return max(0, -((self.start - self.end) // self.step))
+    def __iter__(self):
+        t = self.start
+        while t < self.end:
+            yield {"start": t, "delta": self.step}
+            t += self.step
+    def __getitem__(self, idx):
+        return {"start": self.start + idx * self.step, "delta": self.step}
+
+def _unravel_space(root_d, _dt=False, _td=False):
 
     # range?
     if isinstance(root_d, dict) and {"_from", "_to"} <= set(root_d.keys()):
@@ -54,12 +172,7 @@ def unravel_dict(root_d, _dt=False, _td=False):
                 steps = pd.to_timedelta(root_d['_step']).tolist()
             else:
                 steps = [pd.to_timedelta(root_d['_step'])]
-            root_d = []
-            for stepsize in steps:
-                t = start
-                while t < end:
-                    root_d.append({"start": t, "delta": stepsize})
-                    t += stepsize
+            return _Concat([_Values(_DtRange(start, end, stepsize)) for stepsize in steps])
         elif _td is True:
             raise ValueError("Cannot make a range from time-delta's!", root_d)
         else: # normal range
@@ -71,38 +184,33 @@ def unravel_dict(root_d, _dt=False, _td=False):
                 steps = [root_d['_step']]
 
             start, end = root_d['_from'], root_d['_to']
-            root_d = []
-            for stepsize in steps:
-                root_d += list(range(start, end, stepsize))
-
+            return _Concat([_Values(range(start, end, stepsize)) for stepsize in steps])
 
     if isinstance(root_d, dict):
+        items = []
         for key, val in root_d.items():
             if key.endswith(MAGIC_DT):
-                sub_dicts = unravel_dict(val, _dt=True)
+                items.append((key, _unravel_space(val, _dt=True)))
             elif key.endswith(MAGIC_TD):
-                sub_dicts = unravel_dict(val, _td=True)
+                items.append((key, _unravel_space(val, _td=True)))
             else:
-                sub_dicts = unravel_dict(val)
-            new_dicts = [d | {key : sd} for sd in sub_dicts for d in new_dicts]
+                items.append((key, _unravel_space(val)))
+        return _Product(items)
 
     elif isinstance(root_d, list):
-        new_dicts = [unravel_dict(val) for val in root_d]
-        new_dicts = [d for lst in new_dicts for d in lst]
+        return _Concat([_unravel_space(val) for val in root_d])
 
     elif isinstance(root_d, str):
         if "*" in root_d: # filename, expand
-            new_dicts = natsorted(glob.glob(root_d))
+            return _Values(natsorted(glob.glob(root_d)))
         elif _dt is True: # datetime, convert
-            new_dicts = [pd.to_datetime(root_d)]
+            return _Values([pd.to_datetime(root_d)])
         elif _td is True: # time delta, convert
-            new_dicts = [pd.to_timedelta(root_d)]
+            return _Values([pd.to_timedelta(root_d)])
         else:
-            new_dicts = [root_d]
+            return _Values([root_d])
     else:
-        new_dicts = [root_d] # nothing to unravel
-
-    return new_dicts
+        return _Values([root_d]) # nothing to unravel
 
 def flat_dict(d, separator="/"):
     assert isinstance(d, dict), f"Expected dictionary but got {type(d)}"
@@ -164,31 +272,254 @@ def dt_to_str_in_dict(d):
         return d
 
 
+def config_hash(config):
+    """
+        Stable fingerprint of a configuration.
+        The config is hashed in its `dt_to_str_in_dict` form, i.e., the form it is written to disk in,
+        so a planned config and its `config.json` on disk share the same hash.
+    """
+    canonical = json.dumps(dt_to_str_in_dict(config), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+###########################
+#         Manifest        #
+###########################
+# The manifest is an append-only json-lines file in the root of the output directory.
+# Each line is a record of a run directory, later records of the same directory update earlier ones.
+# Status of a run is one of "running", "done", "timeout", "empty" or "removed".
+# Appending is not atomic over NFS, so shards of a batch running on different machines each write their own manifest,
+# these are read after the main manifest.
+# A reader may see the last line of a manifest while it is being appended, such a truncated line is skipped.
+# Shard manifests are only merged into the main manifest by an explicit call to `rebuild_manifest`,
+# a missing or corrupt main manifest is rebuilt from disk next to the shard manifests, which may still be written to.
+
+def timestamp():
+    return datetime.now().isoformat(timespec="milliseconds")
+
+def append_manifest(output_dir, record, fname=MANIFEST):
+    """
+        Append a record to the manifest.
+        The record is written with a single `write` on a file opened in append mode,
+        so concurrent writers never interleave their records.
+    """
+    extend_manifest(output_dir, [record], fname)
+
+def extend_manifest(output_dir, records, fname=MANIFEST):
+    """
+        Append several records to the manifest at once, with a single `write` like `append_manifest`
+    """
+    if len(records) == 0:
+        return
+    lines = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+    fd = os.open(join(output_dir, fname), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, lines)
+    finally:
+        os.close(fd)
+
+def read_manifest(output_dir):
+    """
+        Read the manifest of an output directory into a dict mapping each run directory to its latest record.
+        Raises FileNotFoundError if there is no manifest, and ValueError if it is corrupt.
+        A truncated last line, i.e., a record still being appended, is skipped.
+    """
+    fnames = natsorted(glob.glob(join(glob.escape(output_dir), SHARD_MANIFEST.format("*"))))
+    if os.path.exists(join(output_dir, MANIFEST)) or len(fnames) == 0:
+        fnames = [join(output_dir, MANIFEST)] + fnames
+
+    runs = dict()
+    for fname in fnames:
+        with open(fname, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if line.endswith("\n"):
+                        raise
+                    continue # the last line, still being appended
+                if not isinstance(record, dict) or "dir" not in record or "status" not in record:
+                    raise ValueError(f"Invalid record in manifest {fname}: {line}")
+                runs.setdefault(record['dir'], dict()).update(record)
+    return runs
+
+def rebuild_manifest(output_dir, merge_shards=True):
+    """
+        Rebuild the manifest of an output directory by scanning all run directories on disk.
+        Use this when run directories were added or removed by hand, but never while a batch is running.
+        With `merge_shards`, manifests of shards are merged into the main manifest, i.e., they are removed.
+    """
+    records = []
+    for entry in sorted(os.scandir(output_dir), key=lambda e: e.name):
+        if not entry.is_dir(): # robustify the code to some dummy files, e.g .DS_Store
+            continue
+        content = listdir(entry.path)
+        if CONFIG not in content:
+            # the config is written last, so a run with artifacts but no config did not finish, e.g., its worker was killed
+            records.append(dict(dir=entry.name, status="running" if len(content) != 0 else "empty",
+                                artifacts=sorted(content)))
+            continue
+        with open(join(entry.path, CONFIG), "r") as f:
+            config = json.loads(f.read())
+        end = None
+        if META in content: # the end time the run got in the manifest when it finished, so results cached with it stay valid
+            with open(join(entry.path, META), "r") as f:
+                end = json.loads(f.read()).get('end')
+        if end is None:
+            end = datetime.fromtimestamp(os.path.getmtime(join(entry.path, CONFIG))).isoformat(timespec="milliseconds")
+        status = "done"
+        if any(fname.startswith("status.txt") for fname in content): # e.g., timed out, possibly compressed by an earlier version
+            from .serializers import find_file, open_file # the serializers depend on utils
+            with open_file(find_file(join(entry.path, "status.txt")), "r") as f:
+                status = f.read().strip()
+            if status not in FINISHED: # status returned by the experiment itself
+                status = "done"
+        records.append(dict(dir=entry.name, hash=config_hash(config), status=status, end=end,
+                            artifacts=sorted(fname for fname in content if fname != CONFIG)))
+
+    # several machines may rebuild at the same time, do not share the temporary file
+    tmp_name = join(output_dir, f"{MANIFEST}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp_name, "w") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+    os.replace(tmp_name, join(output_dir, MANIFEST))
+    if merge_shards:
+        for fname in glob.glob(join(glob.escape(output_dir), SHARD_MANIFEST.format("*"))):
+            os.remove(fname)
+    return {record['dir']: record for record in records}
+
+def load_manifest(output_dir):
+    """
+        Read the manifest of an output directory, rebuilds it from disk if it is missing or corrupt.
+        Manifests of shards are kept, as other shards may still be running, and read after the rebuilt manifest.
+    """
+    try:
+        return read_manifest(output_dir)
+    except (FileNotFoundError, ValueError):
+        runs = rebuild_manifest(output_dir, merge_shards=False)
+    try:
+        return read_manifest(output_dir)
+    except ValueError: # a corrupt shard manifest
+        return runs
+
+
 ###########################
 #      Loading results    #
 ###########################
-def results_to_df(dirname, fnames=[], separator="/", ignore_missing=False):
-    dirs = sorted(listdir(dirname))
-    dirs = [d for d in dirs if os.path.isdir(os.path.join(dirname, d))]
-    pbar = tqdm(total=len(dirs), desc="Reading results from disk")
-    missing = []
-    data = []
+def results_to_df(dirname, fnames=[], separator="/", ignore_missing=False, num_workers=8, cache=False, store=False, lazy=False,
+                  where=None, since=None):
+    """
+        Load the config and the artifacts in `fnames` of all finished runs in `dirname` into a dataframe, one row per run.
+        Runs are read in parallel by `num_workers` threads.
+        With `cache`, loaded artifacts which flatten to scalar columns (e.g., the config, `.txt` and small `.json` artifacts) are kept
+        in a cache file in `dirname`, so loading again only reads runs which are new or changed since, according to the manifest.
+        With `store`, the config and artifacts are read from the result store where possible, and from files otherwise.
+        With `lazy`, only the config and `.txt` and `.json` artifacts are read right away, other artifacts become a `LazyArtifact`
+        which is read when first used, or a memory-mapped array if their serializer supports it (e.g., `.npy` files).
+        Lazy artifacts are not cached.
+        With `where`, only runs whose config matches are loaded, either a partial config (see `dict_subset`)
+        or a function taking the config and returning whether to load the run.
+        It is evaluated on the configs first, so artifacts are only read for matching runs.
+        With `since` (a datetime or ISO-formatted string), only runs which finished after it are loaded.
+    """
+    manifest = load_manifest(dirname)
+    dirs = sorted(d for d, record in manifest.items() if record['status'] in FINISHED)
+    cached = load_results_cache(dirname) if cache is True else dict()
+
+    if since is not None:
+        since = pd.to_datetime(since).to_pydatetime()
+        dirs = [d for d in dirs if manifest[d].get('end') is not None and datetime.fromisoformat(manifest[d]['end']) > since]
+    if where is not None:
+        dirs = _filter_runs(dirname, manifest, dirs, where, num_workers, cached)
+
+    if store is True:
+        from .store import read_store # the store depends on utils
+        attrs = [fname.split("/")[-1].split(".")[0] for fname in fnames]
+        df, found = read_store(dirname, attrs)
+        if separator != "/":
+            df.columns = [c.replace("/", separator) for c in df.columns]
+        in_store = [d for d in dirs if d in df.index]
+        in_store_set = set(in_store)
+        not_in_store = [d for d in dirs if d not in in_store_set]
+        file_fnames = [fname for fname, attr in zip(fnames, attrs) if attr not in found]
+
+        # artifacts not in the store, and runs written before the store was used are read from files
+        df_files, entries = _read_runs(dirname, manifest, in_store, file_fnames, separator, ignore_missing, num_workers, cached, lazy)
+        df_rest, rest_entries = _read_runs(dirname, manifest, not_in_store, [CONFIG] + fnames, separator, ignore_missing, num_workers, cached, lazy)
+        df = pd.concat([df.loc[in_store].join(df_files), df_rest]).loc[dirs]
+        entries |= rest_entries
+    else:
+        df, entries = _read_runs(dirname, manifest, dirs, [CONFIG] + fnames, separator, ignore_missing, num_workers, cached, lazy)
+
+    if cache is True: # keep the cached artifacts of runs which were not loaded now
+        save_results_cache(dirname, {d: entry for d, entry in (cached | entries).items() if d in manifest})
+    return df
+
+def _cached_entry(cached, manifest, edir):
+    # a run which is run again gets a new end time in the manifest
+    entry = cached.get(edir)
+    if entry is None or entry['end'] != manifest[edir].get('end'):
+        entry = dict(end=manifest[edir].get('end'), values=dict())
+    return entry
+
+def _filter_runs(dirname, manifest, dirs, where, num_workers, cached):
+    """
+        Runs in `dirs` of which the config matches `where`.
+        The configs read are added to `cached`, so they are not read again when loading the runs.
+    """
+    match = where if callable(where) else (lambda config: dict_subset(where, config))
+    def load_config(edir):
+        entry = _cached_entry(cached, manifest, edir)
+        if CONFIG not in entry['values']:
+            entry['values'][CONFIG] = load_from_file(join(dirname, edir, CONFIG))
+        return entry
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        entries = list(executor.map(load_config, dirs))
+    cached.update(zip(dirs, entries))
+    return [edir for edir, entry in zip(dirs, entries) if match(entry['values'][CONFIG])]
+
+def _read_runs(dirname, manifest, dirs, fnames, separator, ignore_missing, num_workers, cached, lazy=False):
+    """
+        Read the artifacts in `fnames` of the runs in `dirs` into a dataframe.
+        Also returns the (cached) artifacts of each run.
+    """
+    def load_run(edir):
+        entry = _cached_entry(cached, manifest, edir)
 
-    for edir in dirs:
-        row = dict()
-        for fname in [CONFIG] + fnames:
+        row, missing = dict(), []
+        for fname in fnames:
             fullname = join(dirname, edir, fname)
             attr = fname.split("/")[-1].split(".")[0]  # remove extension
             try:
-                res = {attr: load_from_file(fullname)}
+                if fname in entry['values']:
+                    value = entry['values'][fname]
+                else:
+                    value = load_from_file(fullname, lazy=lazy)
+                    if lazy is False or fname.endswith(EAGER):
+                        entry['values'][fname] = value
+                res = {attr: value}
                 row.update(flat_dict(res, separator))
             except FileNotFoundError as e:
                 if ignore_missing is True:
                     missing.append(fullname)
                 else:
                     raise e
-        data.append(row)
-        pbar.update()
+        return entry, row, missing
+
+    if len(dirs) == 0 or len(fnames) == 0:
+        return pd.DataFrame(index=dirs), dict()
+
+    pbar = tqdm(total=len(dirs), desc="Reading results from disk")
+    missing = []
+    data = []
+    entries = dict()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for edir, (entry, row, run_missing) in zip(dirs, executor.map(load_run, dirs)):
+            entries[edir] = entry
+            data.append(row)
+            missing += run_missing
+            pbar.update()
+    pbar.close()
 
     #if len(missing):
     #    print(f"WARNING: missing following files:")
@@ -197,46 +528,91 @@ def results_to_df(dirname, fnames=[], separator="/", ignore_missing=False):
 
     df = pd.DataFrame.from_dict(data)
     df.index = dirs
-    return df
+    return df, entries
+
+def load_results_cache(dirname):
+    try:
+        with open(join(dirname, RESULTS_CACHE), "rb") as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return dict()
+
+def save_results_cache(dirname, entries):
+    """
+        Save the cached artifacts of the runs in `entries`, leaving out artifacts with other values than scalars,
+        e.g., arrays and pickled objects, which are cheaper to read from their own files than from one big cache file
+    """
+    entries = {edir: dict(end=entry['end'], values={fname: value for fname, value in entry['values'].items() if _is_scalar(value)})
+               for edir, entry in entries.items()}
+    tmp_name = join(dirname, f"{RESULTS_CACHE}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp_name, "wb") as f:
+        pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_name, join(dirname, RESULTS_CACHE))
+
+
+def _is_scalar(value):
+    return isinstance(value, dict) and all(val is None or can_stringify(val) for val in flat_dict(value).values())
 
 
-def load_from_file(fname) -> dict:
+def load_from_file(fname, lazy=False) -> dict:
+    """
+        Load an artifact, using the serializer registered for its extension (see `serializers.register_serializer`).
+        Compressed artifacts are read transparently, i.e., loading "trace.lst" reads "trace.lst.gz" if only that exists.
+        Json files are returned as is, other artifacts as a dict mapping the name of the artifact to its value.
+        With `lazy`, artifacts other than `.txt` and `.json` files are not read yet, see `LazyArtifact`.
+    """
+    from .serializers import get_serializer, find_file, is_compressed # the serializers depend on utils
     attr = fname.split("/")[-1].split(".")[0] #remove extension
 
-    if fname.endswith(".json"):
+    fname = find_file(fname) # possibly compressed
+    serializer = get_serializer(fname)
+    if serializer is None:
+        raise ValueError(f"Unknown file extension for file {fname}")
+    if serializer.ext == ".json":
         try:
-            with open(fname, "r") as f:
-                txt = f.read()
-                if len(txt):
-                    return json.loads(txt)
-                else:
-                    return dict()
+            return serializer.load_from_file(fname)
         except JSONDecodeError as e:
             print(f"Error while loading {fname}")
             raise e
-    elif fname.endswith(".pickle"):
-        with open(fname, "rb") as f:
-            return {attr: pickle.loads(f.read())}
-    elif fname.endswith(".txt"):
-        with open(fname, "r") as f:
-            str_val = f.read()
-            try:
-                return {attr: eval(str_val)}
-            except (NameError, SyntaxError):
-                return {attr : str_val}
-    elif fname.endswith(".lst"):
-        with open(fname, "r") as f:
-            res = []
-            for l in f.readlines():
-                try:
-                    res.append(eval(l.strip()))
-                except NameError:
-                    res.append(l.strip())
-            return {attr : res}
-    else:
-        raise ValueError(f"Unknown file extension for file {fname}")
-
-
-
+    if lazy is True and serializer.ext not in EAGER:
+        if serializer.mmap is not None and not is_compressed(fname):
+            return {attr: serializer.mmap(fname)}
+        return {attr: LazyArtifact(fname)}
+    return {attr: serializer.load_from_file(fname)}
 
 
+class LazyArtifact:
+    """
+        Proxy of an artifact which is read from disk when it is first used.
+        The artifact itself is `.value`, attribute access, indexing and conversion to a numpy array are forwarded to it.
+        Use `.release()` to free the memory of an artifact which was read.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self._value = None
+        self._loaded = False
+
+    @property
+    def value(self):
+        if self._loaded is False:
+            self._value = next(iter(load_from_file(self.fname).values()))
+            self._loaded = True
+        return self._value
+
+    def release(self):
+        self._value = None
+        self._loaded = False
+
+    def __getattr__(self, name):
+        if name.startswith("_"): # not forwarded, e.g., while unpickling
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.value, dtype=dtype)
+
+    def __repr__(self):
+        return f"LazyArtifact({self.fname!r}{', loaded' if self._loaded else ''})"
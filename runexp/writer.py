@@ -0,0 +1,119 @@
+import logging
+import os
+import queue
+import threading
+from multiprocessing import util
+
+from .utils import extend_manifest
+
+WRITER_QUEUE = 16 # results waiting to be written in a process, experiments wait for the writer when the queue is full
+WRITER_THREADS = 4 # threads writing results in a process, so the latency of a network filesystem is spread over several writes
+WRITER_BATCH = 64 # maximum number of runs marked as finished in the manifest at once
+
+# With `async_writes`, experiments do not save their results themselves: they hand them to the writer of their process
+# and the worker goes on with its next experiment while the results are written.
+# The writer saves each result with the config last, written to a temporary file which is renamed once complete
+# (a run directory with a config is finished, see `rebuild_manifest`),
+# and marks all runs it wrote since it last looked at the queue as finished with a single write to the manifest.
+# A result which can not be saved fails its run (see `Runner.save_experiment`), like in the experiment loop.
+# Other errors, e.g., writing the manifest, are raised in the experiment loop by the next `submit` or `flush`.
+# Writers of pool workers are flushed when the worker exits, where errors can only be printed,
+# so the batch reads how the runs it handed to writers finished from the manifest (see `Runner.count_written`).
+# Results not written yet are lost when a worker is killed, their runs are still "running" so they run again when the batch is resumed.
+
+class ResultWriter:
+    """
+        Writes results handed over by `submit` in `threads` background threads, holding at most `maxsize` results which are not written yet
+    """
+
+    def __init__(self, maxsize=WRITER_QUEUE, threads=WRITER_THREADS, batch=WRITER_BATCH):
+        self.queue = queue.Queue(maxsize)
+        self.batch = batch
+        self.error = None
+        self.threads = [threading.Thread(target=self._loop, name=f"runexp-writer-{i}", daemon=True) for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, runner, config, result, status, dirname, meta):
+        """
+            Hand over the result of an experiment to write, waits while the queue is full.
+            Raises the error of a result which could not be written before.
+        """
+        self.check()
+        self.queue.put((runner, config, result, status, dirname, meta))
+
+    def flush(self):
+        """
+            Wait until all results handed over are written
+        """
+        self.queue.join()
+        self.check()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _loop(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def write(self, items):
+        finished = dict() # (output directory, manifest) -> runner, records
+        for runner, config, result, status, dirname, meta in items:
+            try:
+                record = runner.save_experiment(config, result, status, dirname, meta, mark_finished=False)
+            except Exception as e: # raised in the experiment loop by the next `submit` or `flush`
+                logging.exception(f"Could not write the result of {dirname}")
+                self.error = self.error or e
+                continue
+            finished.setdefault((runner.output_dir, runner.manifest_name()), (runner, []))[1].append(record)
+        for (output_dir, manifest), (runner, records) in finished.items():
+            try:
+                with runner.dirlock:
+                    extend_manifest(output_dir, records, manifest)
+            except Exception as e:
+                logging.exception(f"Could not mark {len(records)} runs as finished in {manifest}")
+                self.error = self.error or e
+
+
+_writer = None
+_writer_lock = threading.Lock() # experiments of the thread executor start using the writer at the same time
+
+def result_writer(maxsize=WRITER_QUEUE, threads=WRITER_THREADS):
+    """
+        The writer of this process, started when it is first used
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = ResultWriter(maxsize, threads)
+                # pool workers write all results before they exit, finalizers run when a worker process ends
+                util.Finalize(writer, writer.flush, exitpriority=10)
+                _writer = writer
+    return _writer
+
+def flush_writer():
+    """
+        Wait until the writer of this process, if any, wrote all results handed over
+    """
+    if _writer is not None:
+        _writer.flush()
+
+def _forget_writer(): # the thread of the writer does not exist in a forked process, nor does a thread holding the lock
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_forget_writer)
@@ -26,7 +26,7 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
-    install_requires=["tqdm", "natsort"],
+    install_requires=["tqdm", "natsort", "numpy", "pandas"],
     classifiers=[
         "Programming Language :: Python :: 3 :: Only",
         "Programming Language :: Python :: 3.6",
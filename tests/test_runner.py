@@ -1,8 +1,18 @@
 
 
 import unittest
+import contextlib
+import glob
+import io
+import json
 import tempfile
+import multiprocessing
 import os
+import resource
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import runexp
 
@@ -14,6 +24,76 @@ def make_lst(size_in_bytes):
 def dummy(*args, **kwargs):
     return dict(result="None")
 
+def getpid(*args, **kwargs):
+    return dict(pid=os.getpid())
+
+def fail(*args, **kwargs):
+    raise ValueError("Experiment failed")
+
+def sleep(size, seed):
+    time.sleep(size / 100)
+    return dict(size=size)
+
+def busy(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+    return dict(result="finished")
+
+def mixed(size, seed):
+    return dict(size=size, stats=dict(mean=size / 2, name=f"run{seed}"), trace=list(range(size)))
+
+def arrays(size):
+    import numpy as np
+    return dict(size=size, array=np.arange(size), trace=dict(values=list(range(size)), array=np.arange(size)))
+
+async def wait(size, seed):
+    import asyncio
+    await asyncio.sleep(size / 10)
+    return dict(size=size, pid=os.getpid())
+
+def shared_result(builder, total, seed):
+    return dict(builder=builder, total=total)
+
+class SharedRunner(runexp.Runner):
+    def prepare_shared(self, config_subset):
+        return dict(pid=os.getpid(), data=list(range(config_subset["data/size"])))
+    def make_kwargs(self, config):
+        shared = self.shared(config)
+        return dict(builder=shared['pid'], total=sum(shared['data']), seed=config['seed'])
+
+flaky_calls = dict()
+
+def flaky(size, seed):
+    # size 4 always fails, other even sizes fail with an OSError the first time they run in a process
+    if size == 4:
+        raise ValueError("always fails")
+    flaky_calls[size] = flaky_calls.get(size, 0) + 1
+    if size % 2 == 0 and flaky_calls[size] == 1:
+        raise OSError(f"flaky {size}")
+    return dict(size=size)
+
+def flags(size, seed, layers):
+    return dict(ok=size > 1, config=dict(name=f"run{size}"))
+
+def unsaveable(size, seed):
+    # a lambda can not be pickled
+    return dict(size=size, fn=lambda: size) if size == 2 else dict(size=size)
+
+def run_shard(output_dir, config, shard):
+    runner = RunnerTests.MyRunner(dummy, output=output_dir, confirm=False)
+    runner.run_batch(config, shard=shard, show_progress=False)
+
+def run_dirs(output_dir):
+    return [d for d in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, d))]
+
+class ChunkRunner(runexp.Runner):
+    # remembers the number of experiments the chunksize was based on
+    def make_kwargs(self, config): return config
+    def auto_chunksize(self, n_experiments, num_workers, tasks_per_child):
+        self.n_planned = getattr(self, "n_planned", []) + [n_experiments]
+        return super().auto_chunksize(n_experiments, num_workers, tasks_per_child)
+
 class Hashable:
     def __hash__(self): return 1
     def __eq__(self, other): return True
@@ -30,19 +110,652 @@ class RunnerTests(unittest.TestCase):
         tempdir = os.path.join(tempfile.mkdtemp(), "results")
         runner = self.MyRunner(dummy, output=tempdir)
         runner.run_one(config=dict(key1="val1", key2="val2", key_lst=[1,2,3]))
-        self.assertEqual(len(os.listdir(tempdir)), 1)
+        self.assertEqual(len(run_dirs(tempdir)), 1)
 
     def test_batch(self):
         tempdir = os.path.join(tempfile.mkdtemp(), "results")
         runner = self.MyRunner(dummy, output=tempdir)
         runner.run_batch(config=dict(key1="val1", key2="val2", key_lst=[1, 2, 3]))
-        self.assertEqual(len(os.listdir(tempdir)), 3)
+        self.assertEqual(len(run_dirs(tempdir)), 3)
 
     def test_batch_parallel(self):
         tempdir = os.path.join(tempfile.mkdtemp(), "results")
         runner = self.MyRunner(dummy, output=tempdir)
         runner.run_batch(config=dict(key1="val1", key2="val2", key_lst=[1, 2, 3]), parallel=True)
-        self.assertEqual(len(os.listdir(tempdir)), 3)
+        self.assertEqual(len(run_dirs(tempdir)), 3)
+
+    def test_filter_experiments(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(dummy, output=tempdir)
+        runner.run_batch(config=dict(key1="val1", key_lst=[1, 2, 3]))
+
+        planned = runexp.unravel_dict(dict(key1="val1", key_lst=[1, 2, 3, 4]))
+        self.assertEqual(runner.filter_experiments(planned), [dict(key1="val1", key_lst=4)])
+        # duplicate configs are only skipped as many times as they were run
+        self.assertEqual(runner.filter_experiments(planned[:1] * 2), planned[:1])
+
+    def test_manifest(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(dummy, output=tempdir)
+        runner.run_batch(config=dict(key1="val1", key_lst=[1, 2, 3]))
+
+        manifest = runexp.utils.read_manifest(tempdir)
+        self.assertEqual(sorted(manifest), ["000001", "000002", "000003"])
+        for record in manifest.values():
+            self.assertEqual(record['status'], "done")
+            self.assertEqual(record['artifacts'], ["result.txt", runexp.utils.META])
+            self.assertLessEqual(record['start'], record['end'])
+
+        # missing or corrupt manifests are rebuilt from disk
+        os.remove(os.path.join(tempdir, runexp.utils.MANIFEST))
+        rebuilt = runexp.utils.load_manifest(tempdir)
+        self.assertEqual({d: r['hash'] for d, r in rebuilt.items()}, {d: r['hash'] for d, r in manifest.items()})
+        with open(os.path.join(tempdir, runexp.utils.MANIFEST), "a") as f:
+            f.write('{"dir": "0000')
+        # a truncated last line is a record still being appended
+        self.assertEqual(runexp.utils.read_manifest(tempdir).keys(), manifest.keys())
+        with open(os.path.join(tempdir, runexp.utils.MANIFEST), "a") as f:
+            f.write('\n')
+        self.assertRaises(ValueError, runexp.utils.read_manifest, tempdir)
+        self.assertEqual(runexp.utils.load_manifest(tempdir).keys(), manifest.keys())
+
+        # a run whose worker was killed before its config was written did not finish
+        os.makedirs(os.path.join(tempdir, "000004"))
+        with open(os.path.join(tempdir, "000004", "result.txt"), "w") as f:
+            f.write("val1")
+        os.remove(os.path.join(tempdir, runexp.utils.MANIFEST))
+        self.assertEqual(runexp.utils.load_manifest(tempdir)["000004"]['status'], "running")
+        runner.run_batch(config=dict(key1="val1", key_lst=[1, 2, 3, 4]))
+        self.assertEqual(runexp.utils.read_manifest(tempdir)["000005"]['status'], "done")
+        shutil.rmtree(os.path.join(tempdir, "000005"))
+        shutil.rmtree(os.path.join(tempdir, "000004"))
+        runexp.utils.rebuild_manifest(tempdir)
+
+        # removed directories are filled up again
+        os.rmdir(runner.mkdir())
+        for fname in os.listdir(os.path.join(tempdir, "000002")):
+            os.remove(os.path.join(tempdir, "000002", fname))
+        runner.remove_empty_subdirs()
+        self.assertEqual(runner.next_emtpy_index(), 2)
+
+    def test_fill_gaps(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(dummy, output=tempdir)
+        runner.run_batch(config=dict(key_lst=[1, 2, 3]))
+        for fname in os.listdir(os.path.join(tempdir, "000002")):
+            os.remove(os.path.join(tempdir, "000002", fname))
+        runner.remove_empty_subdirs()
+
+        runner.run_batch(config=dict(key_lst=[1, 2, 3, 4, 5]))
+        manifest = runexp.utils.read_manifest(tempdir)
+        self.assertEqual(sorted(run_dirs(tempdir)), ["000001", "000002", "000003", "000004", "000005"])
+        self.assertEqual(manifest["000002"]['hash'], runexp.utils.config_hash(dict(key_lst=2)))
+        self.assertEqual(manifest["000004"]['hash'], runexp.utils.config_hash(dict(key_lst=4)))
+
+    def test_shards(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        os.makedirs(tempdir)
+        config = dict(key1="val1", key_lst=list(range(10)))
+
+        # launch all shards at once against the same output directory
+        procs = [multiprocessing.Process(target=run_shard, args=(tempdir, config, (i, 3))) for i in range(1, 4)]
+        for proc in procs: proc.start()
+        for proc in procs: proc.join()
+        self.assertTrue(all(proc.exitcode == 0 for proc in procs))
+
+        manifest = runexp.utils.load_manifest(tempdir)
+        self.assertEqual(len(run_dirs(tempdir)), 10)
+        self.assertEqual(sorted(r['hash'] for r in manifest.values() if r['status'] == "done"),
+                         sorted(runexp.utils.config_hash(c) for c in runexp.unravel_dict(config)))
+        # shard manifests are only merged by an explicit rebuild
+        shard_manifests = glob.glob(os.path.join(tempdir, runexp.utils.SHARD_MANIFEST.format("*")))
+        self.assertEqual(len(shard_manifests), 3)
+        with open(os.path.join(tempdir, runexp.utils.MANIFEST), "w") as f:
+            f.write('corrupt\n')
+        self.assertEqual(runexp.utils.load_manifest(tempdir).keys(), manifest.keys())
+        self.assertTrue(all(os.path.exists(fname) for fname in shard_manifests))
+        # running again skips everything, also when not sharded
+        run_shard(tempdir, config, (2, 3))
+        run_shard(tempdir, config, None)
+        self.assertEqual(len(run_dirs(tempdir)), 10)
+
+        parser = runexp.default_parser()
+        args = parser.parse_args(["config.json", "func", "runner", "output", "--shard", "2/3"])
+        self.assertEqual(args.shard, (2, 3))
+
+    def test_persistent_workers(self):
+        for tasks_per_child in [None, 0]: # 0 as given on the command line
+            tempdir = os.path.join(tempfile.mkdtemp(), "results")
+            runner = self.MyRunner(getpid, output=tempdir, memory_limit=1024)
+            runner.run_batch(config=dict(key_lst=list(range(10))), parallel=True, num_workers=2, tasks_per_child=tasks_per_child)
+
+            df = runexp.utils.results_to_df(tempdir, ["pid.txt"])
+            self.assertEqual(len(df), 10)
+            self.assertLessEqual(df["pid/pid"].nunique(), 2)
+
+    def test_chunksize(self):
+        for ordered in [True, False]:
+            tempdir = os.path.join(tempfile.mkdtemp(), "results")
+            runner = self.MyRunner(getpid, output=tempdir)
+            runner.run_batch(config=dict(key_lst=list(range(10))), parallel=True, num_workers=2,
+                             tasks_per_child=None, chunksize=3, ordered=ordered)
+            self.assertEqual(len(run_dirs(tempdir)), 10)
+
+        self.assertEqual(runner.auto_chunksize(1000, 4, tasks_per_child=1), 1)
+        self.assertEqual(runner.auto_chunksize(1000, 4, tasks_per_child=None), runexp.runexp.MAX_CHUNKSIZE)
+        self.assertEqual(runner.auto_chunksize(10, 4, tasks_per_child=None), 1)
+        self.assertEqual(runner.auto_chunksize(1000, 4, tasks_per_child=10), 5)
+
+        # the chunksize is based on the experiments which still have to run
+        runner = ChunkRunner(getpid, output=tempdir, confirm=False)
+        runner.run_batch(config=dict(key_lst=list(range(12))), parallel=True, num_workers=2, tasks_per_child=None)
+        self.assertEqual(runner.n_planned, [2])
+
+    def test_longest_first(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(sleep, output=tempdir)
+        runner.cost_keys = ["size"]
+        runner.run_batch(config=dict(size=[1, 5, 3], seed=0))
+        self.assertAlmostEqual(runner.estimate_cost(dict(size=5, seed=1)), 0.05, delta=0.04)
+
+        runner.run_batch(config=dict(size=[1, 5, 3], seed=1), longest_first=True)
+        df = runexp.utils.results_to_df(tempdir, ["size.txt"])
+        self.assertEqual(list(df["size/size"]), [1, 5, 3, 5, 3, 1])
+
+        # without cost keys, seeds do not count
+        runner.cost_keys = None
+        self.assertEqual(runner.cost_config(dict(size=5, seed=2, data=dict(split_seed=3))), {"size": 5})
+        runner.cost_history = None
+        self.assertAlmostEqual(runner.estimate_cost(dict(size=5, seed=2)), 0.05, delta=0.04)
+        self.assertGreater(runner.estimate_cost(dict(size=5, seed=2)), runner.estimate_cost(dict(size=1, seed=2)))
+
+    def test_timeout(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(sleep, output=tempdir)
+        start = time.time()
+        runner.run_batch(config=dict(size=[1, 1000, 2], seed=0), timeout=0.5)
+        self.assertLess(time.time() - start, 5)
+        self.assertIsNone(runner.timeout) # only for the batch
+
+        manifest = runexp.utils.read_manifest(tempdir)
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done", "timeout", "done"])
+        self.assertIn("err.txt", os.listdir(os.path.join(tempdir, "000002")))
+        with open(os.path.join(tempdir, "000002", "status.txt"), "r") as f:
+            self.assertEqual(f.read(), "timeout")
+        self.assertEqual(runner.filter_experiments(runexp.unravel_dict(dict(size=[1, 1000, 2], seed=0))), [])
+
+        # experiments timing out right after they were forked are killed as well
+        runner = self.MyRunner(sleep, output=os.path.join(tempfile.mkdtemp(), "results"), timeout=1e-9)
+        start = time.time()
+        runner.run_batch(config=dict(size=[300] * 5, seed=0), show_progress=False)
+        self.assertLess(time.time() - start, 5)
+
+        # exceptions of the experiment are passed to the runner
+        runner = self.MyRunner(fail, output=tempdir, confirm=False, timeout=10)
+        runner.run_experiment(dict(key="val"))
+        with open(os.path.join(tempdir, "000004", "err.txt"), "r") as f:
+            self.assertIn("ValueError: Experiment failed", f.read())
+
+    def test_cpu_limit(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(busy, output=tempdir, cpu_limit=1)
+        runner.run_batch(config=dict(seconds=[0.1, 10]))
+        self.assertIn("result.txt", os.listdir(os.path.join(tempdir, "000001")))
+        self.assertIn("err.txt", os.listdir(os.path.join(tempdir, "000002")))
+
+    def test_results_cache(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(sleep, output=tempdir)
+        runner.run_batch(config=dict(size=[1, 2, 3], seed=0))
+
+        df = runexp.utils.results_to_df(tempdir, ["size.txt"], num_workers=2, cache=True)
+        self.assertIn(runexp.utils.RESULTS_CACHE, os.listdir(tempdir))
+        self.assertEqual(list(df["size/size"]), [1, 2, 3])
+
+        # cached artifacts are not read again
+        os.remove(os.path.join(tempdir, "000002", "size.txt"))
+        cached = runexp.utils.results_to_df(tempdir, ["size.txt"], cache=True)
+        self.assertTrue(df.equals(cached))
+        self.assertRaises(FileNotFoundError, runexp.utils.results_to_df, tempdir, ["size.txt"])
+
+        # runs with a new record in the manifest are read again
+        runexp.utils.append_manifest(tempdir, dict(dir="000002", status="done", end=runexp.utils.timestamp()))
+        cached = runexp.utils.results_to_df(tempdir, ["size.txt"], cache=True, ignore_missing=True)
+        self.assertEqual(list(cached["size/size"].isna()), [False, True, False])
+
+        # only artifacts flattening to scalars are cached, which stay valid when the manifest is rebuilt
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(mixed, output=tempdir)
+        runner.run_batch(config=dict(size=[1, 2], seed=0))
+        df = runexp.utils.results_to_df(tempdir, ["stats.json", "trace.lst"], cache=True)
+        cache = runexp.utils.load_results_cache(tempdir)
+        self.assertEqual(set(cache["000001"]["values"]), {"config.json", "stats.json"})
+        runexp.utils.rebuild_manifest(tempdir)
+        os.remove(os.path.join(tempdir, "000001", "stats.json"))
+        cached = runexp.utils.results_to_df(tempdir, ["stats.json", "trace.lst"], cache=True)
+        self.assertTrue(df.equals(cached))
+
+    def test_results_filter(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(mixed, output=tempdir)
+        runner.run_batch(config=dict(size=[1, 2, 3], seed=[0, 1]))
+
+        df = runexp.utils.results_to_df(tempdir, ["trace.lst"], where=dict(seed=1))
+        self.assertEqual(list(df["config/size"]), [1, 2, 3])
+        self.assertEqual(list(df["config/seed"]), [1, 1, 1])
+        # artifacts are only read for matching runs
+        os.remove(os.path.join(tempdir, "000001", "trace.lst"))
+        df = runexp.utils.results_to_df(tempdir, ["trace.lst"], where=lambda config: config['size'] > 1)
+        self.assertEqual(list(df.index), ["000002", "000003", "000005", "000006"])
+
+        since = runexp.utils.timestamp()
+        self.assertEqual(len(runexp.utils.results_to_df(tempdir, since=since)), 0)
+        time.sleep(0.01)
+        for edir in ["000002", "000003"]:
+            runexp.utils.append_manifest(tempdir, dict(dir=edir, status="done", end=runexp.utils.timestamp()))
+        df = runexp.utils.results_to_df(tempdir, ["size.txt"], since=since, where=dict(size=2))
+        self.assertEqual(list(df.index), ["000002"])
+
+    def test_store(self):
+        fnames = ["size.txt", "stats.json", "trace.lst"]
+        config = dict(size=[1, 2, 3], seed=[0, 1])
+
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(mixed, output=tempdir, store="both")
+        runner.run_batch(config=config, parallel=True, num_workers=2)
+        self.assertIn("size.txt", os.listdir(os.path.join(tempdir, "000001")))
+        from_files = runexp.utils.results_to_df(tempdir, fnames)
+        from_store = runexp.utils.results_to_df(tempdir, fnames, store=True)
+        self.assertTrue(from_files.equals(from_store[from_files.columns]))
+
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(mixed, output=tempdir, store="only")
+        runner.run_batch(config=config)
+        self.assertEqual(sorted(os.listdir(os.path.join(tempdir, "000001"))), [runexp.utils.CONFIG, runexp.utils.META, "trace.lst"])
+        from_store = runexp.utils.results_to_df(tempdir, fnames, store=True)
+        self.assertTrue(from_files.equals(from_store[from_files.columns]))
+        # only the requested results are read from the store
+        self.assertEqual(list(runexp.utils.results_to_df(tempdir, ["size.txt"], store=True).columns),
+                         ["config/size", "config/seed", "size/size"])
+        self.assertEqual(runner.filter_experiments(runexp.unravel_dict(config)), [])
+
+        # bools and lists come back as they were, results never collide with the config
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(flags, output=tempdir, store="only")
+        runner.run_batch(config=dict(size=[1, 2], seed=0, layers=(8, 8)))
+        from_store = runexp.utils.results_to_df(tempdir, ["ok.txt", "config.json"], store=True)
+        self.assertEqual(list(from_store["ok/ok"]), [False, True])
+        self.assertEqual(list(from_store["config/layers"]), [[8, 8], [8, 8]])
+        self.assertEqual(list(from_store["config/size"]), [1, 2])
+        self.assertEqual(list(from_store["config/name"]), ["run1", "run2"])
+
+    def test_serializers(self):
+        import numpy as np
+
+        class Point:
+            def __init__(self, x, y): self.x, self.y = x, y
+
+        runexp.register_serializer(".point", lambda p, f: f.write(f"{p.x},{p.y}"),
+                                   lambda f: Point(*map(int, f.read().split(","))), Point)
+        self.addCleanup(runexp.unregister_serializer, ".point")
+        tempdir = tempfile.mkdtemp()
+        result = dict(ints=list(range(5000)), floats=[0.5] * 2000, short=[1, 2, 3], array=np.arange(12).reshape(3, 4),
+                      point=Point(1, 2), text="foo bar", value=42)
+        self.MyRunner(dummy, output=tempdir, confirm=False).save_result(dict(key="val"), result, tempdir)
+
+        self.assertEqual(sorted(os.listdir(tempdir)), sorted([runexp.utils.CONFIG, "manifest.jsonl", "ints.arr", "floats.arr",
+                                                              "short.lst", "array.npy", "point.point", "text.txt", "value.txt"]))
+        load = lambda fname: runexp.utils.load_from_file(os.path.join(tempdir, fname))[fname.split(".")[0]]
+        self.assertEqual(load("ints.arr"), result['ints'])
+        self.assertEqual(load("floats.arr"), result['floats'])
+        # lists are found whether they were written as `.lst` or `.arr`
+        self.assertEqual(load("ints.lst"), result['ints'])
+        self.assertEqual(load("short.arr"), [1, 2, 3])
+        self.assertEqual(load("short.lst"), [1, 2, 3])
+        self.assertTrue((load("array.npy") == result['array']).all())
+        self.assertEqual((load("point.point").x, load("point.point").y), (1, 2))
+        self.assertEqual(load("text.txt"), "foo bar")
+        self.assertEqual(load("value.txt"), 42)
+
+        # replaced serializers are used again once unregistered
+        builtin = runexp.serializers.get_serializer("value.txt")
+        runexp.register_serializer(".txt", lambda value, f: f.write("x"), lambda f: f.read(), lambda value: False)
+        self.assertIsNot(runexp.serializers.get_serializer("value.txt"), builtin)
+        runexp.unregister_serializer(".txt")
+        self.assertIs(runexp.serializers.get_serializer("value.txt"), builtin)
+        self.assertIs(runexp.serializers.find_serializer(42), builtin)
+
+    def test_compression(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(mixed, output=tempdir, compression="gzip")
+        runner.run_batch(config=dict(size=[1, 2], seed=0))
+        self.assertEqual(sorted(os.listdir(os.path.join(tempdir, "000001"))),
+                         [runexp.utils.CONFIG, runexp.utils.META, "size.txt", "stats.json.gz", "trace.lst.gz"])
+        df = runexp.utils.results_to_df(tempdir, ["size.txt", "stats.json", "trace.lst"])
+        self.assertEqual(list(df["size/size"]), [1, 2])
+        self.assertEqual(len(df.loc["000002", "trace/trace"]), 2)
+        self.assertRaises(ValueError, self.MyRunner, mixed, output=tempdir, confirm=False, compression="zip")
+
+        # the status of failed runs is never compressed, so it is found when rebuilding the manifest
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        self.MyRunner(fail, output=tempdir, compression="gzip").run_batch(config=dict(key="val"))
+        self.assertIn("err.txt", os.listdir(os.path.join(tempdir, "000001")))
+        self.assertEqual(runexp.utils.rebuild_manifest(tempdir)["000001"]['status'], "failed")
+
+    def test_lazy_results(self):
+        import numpy as np
+
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(arrays, output=tempdir)
+        runner.run_batch(config=dict(size=[10, 20]))
+        df = runexp.utils.results_to_df(tempdir, ["size.txt", "array.npy", "trace.pickle"], lazy=True)
+        self.assertEqual(list(df["size/size"]), [10, 20])
+        self.assertIsInstance(df.loc["000001", "array/array"], np.memmap)
+        trace = df.loc["000002", "trace/trace"]
+        self.assertIsInstance(trace, runexp.utils.LazyArtifact)
+        self.assertNotIn("loaded", repr(trace))
+        self.assertEqual(sorted(trace.keys()), ["array", "values"])
+        self.assertIn("loaded", repr(trace))
+        self.assertEqual(trace["values"][-1], 19)
+        self.assertRaises(FileNotFoundError, runexp.utils.results_to_df, tempdir, ["other.pickle"], lazy=True)
+
+    def test_run_meta(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(busy, output=tempdir, store="both")
+        runner.run_batch(config=dict(seconds=[0.2, 0.01]))
+        df = runexp.utils.results_to_df(tempdir, ["runexp_meta.json"])
+        for key in ["pid", "start", "end", "make_kwargs_time", "func_time", "save_time", "cpu_user", "cpu_system", "peak_rss_mb"]:
+            self.assertIn(f"runexp_meta/{key}", df.columns)
+        self.assertEqual(list(df["runexp_meta/pid"]), [os.getpid()] * 2)
+        self.assertGreater(df.loc["000001", "runexp_meta/cpu_user"] + df.loc["000001", "runexp_meta/cpu_system"], 0.19)
+        self.assertGreater(df.loc["000001", "runexp_meta/func_time"], df.loc["000002", "runexp_meta/func_time"])
+        self.assertGreater(df.loc["000001", "runexp_meta/peak_rss_mb"], 1)
+        from_store = runexp.utils.results_to_df(tempdir, ["runexp_meta.json"], store=True)
+        self.assertTrue(df.equals(from_store[df.columns]))
+
+    def test_profile(self):
+        config = dict(size=[100, 200, 300, 400], seed=0)
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        self.MyRunner(mixed, output=tempdir, profile="cpu").run_batch(config=config)
+        for edir in run_dirs(tempdir):
+            self.assertIn(runexp.profiling.PROFILE_CPU, os.listdir(os.path.join(tempdir, edir)))
+        self.assertIn("mixed", runexp.profile_summary(tempdir, "cpu"))
+
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        self.MyRunner(mixed, output=tempdir, profile="mem", timeout=10).run_batch(config=config)
+        with open(os.path.join(tempdir, "000001", runexp.profiling.PROFILE_MEM), "r") as f:
+            self.assertIn("Peak traced memory", f.read())
+        self.assertIn("summed over 4 runs", runexp.profile_summary(tempdir, "mem"))
+
+        # sampled experiments are chosen by config, the same ones are profiled again
+        runner = self.MyRunner(mixed, output=os.path.join(tempfile.mkdtemp(), "results"), profile="cpu", profile_sample=0.5)
+        sampled = [runner.profiled(c) for c in runexp.unravel_dict(dict(size=dict(_from=0, _to=100), seed=0))]
+        self.assertTrue(20 < sum(sampled) < 80)
+        self.assertEqual(sampled, [runner.profiled(c) for c in runexp.unravel_dict(dict(size=dict(_from=0, _to=100), seed=0))])
+
+    def test_status(self):
+        import urllib.request
+
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(sleep, output=tempdir)
+        runner.run_batch(config=dict(size=[1, 2, 3, 4], seed=0), parallel=True, num_workers=2, status_interval=0.05)
+        with open(os.path.join(tempdir, runexp.STATUS), "r") as f:
+            status = json.load(f)
+        self.assertEqual((status['total'], status['finished'], status['running'], status['failed'], status['timeout']), (4, 4, 0, 0, 0))
+        self.assertGreater(status['per_minute'], 0)
+        self.assertEqual(sum(worker['finished'] for worker in status['workers'].values()), 4)
+        for worker in status['workers'].values():
+            self.assertTrue(0 < worker['busy_fraction'] <= 1)
+        # the status is only kept when asked for
+        quiet = self.MyRunner(sleep, output=os.path.join(tempfile.mkdtemp(), "results"))
+        quiet.run_batch(config=dict(size=[1, 2], seed=0))
+        self.assertNotIn(runexp.STATUS, os.listdir(quiet.output_dir))
+
+        # longest running experiments are reported with their config, also over http
+        runexp.utils.append_manifest(tempdir, dict(dir="000005", status="running", start=runexp.utils.timestamp(), pid=1))
+        telemetry = runexp.Telemetry(runner, 5, port=0)
+        telemetry.planned["000005"] = (dict(size=5, seed=0), 1.0)
+        telemetry.offset = 0
+        telemetry.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{telemetry.server.server_address[1]}") as response:
+                status = json.loads(response.read())
+        finally:
+            telemetry.stop()
+        self.assertEqual(status['running'], 1)
+        self.assertEqual(status['slowest_running'][0]['config'], dict(size=5, seed=0))
+
+    def test_failures(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        config = dict(size=[1, 2, 3, 4], seed=0)
+        runner = self.MyRunner(flaky, output=tempdir)
+        runner.run_batch(config=config, parallel=True, num_workers=2)
+        manifest = runexp.utils.read_manifest(tempdir)
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done", "failed", "done", "failed"])
+        with open(os.path.join(tempdir, "000002", "err.txt"), "r") as f:
+            self.assertIn("OSError: flaky 2", f.read())
+        # failed experiments are not run again, unless asked for
+        self.assertEqual(runner.filter_experiments(runexp.unravel_dict(config)), [])
+
+        # shards rerun the failed runs of their own configs, also when the batch ran without shards before
+        sharded = os.path.join(tempfile.mkdtemp(), "results")
+        shutil.copytree(tempdir, sharded)
+        os.makedirs(os.path.join(sharded, "000002", "out")) # e.g., written by a command, removed before the rerun
+        for shard in [(1, 2), (2, 2)]:
+            self.MyRunner(dummy, output=sharded, confirm=False).run_batch(config=config, shard=shard, only_failed=True, show_progress=False)
+        manifest = runexp.utils.load_manifest(sharded)
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done"] * 4)
+
+        # retried experiments succeed in the end, in their own run directory
+        runner = self.MyRunner(flaky, output=tempdir, confirm=False, max_attempts=3, retry_on=OSError, retry_backoff=0.01)
+        runner.run_batch(config=config, only_failed=True)
+        self.assertEqual(runner.n_experiments, 2)
+        manifest = runexp.utils.read_manifest(tempdir)
+        self.assertEqual(sorted(manifest), ["000001", "000002", "000003", "000004"])
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done", "done", "done", "failed"])
+        self.assertNotIn("err.txt", os.listdir(os.path.join(tempdir, "000002")))
+        with open(os.path.join(tempdir, "000002", runexp.utils.META), "r") as f:
+            self.assertEqual(json.load(f)['attempts'], 2)
+        # other exceptions are not retried
+        with open(os.path.join(tempdir, "000004", runexp.utils.META), "r") as f:
+            self.assertEqual(json.load(f)['attempts'], 1)
+
+        # results which can not be saved fail the run as well
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(unsaveable, output=tempdir)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            runner.run_batch(config=dict(size=[1, 2, 3], seed=0), status_interval=None)
+        self.assertIn("1 experiments failed", out.getvalue())
+        manifest = runexp.utils.read_manifest(tempdir)
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done", "failed", "done"])
+        self.assertEqual(sorted(os.listdir(os.path.join(tempdir, "000002"))), ["config.json", "err.txt", runexp.utils.META, "status.txt"])
+
+    def test_shared(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = SharedRunner(shared_result, output=tempdir)
+        runner.shared_keys = ["data/size"]
+        runner.run_batch(config=dict(seed=[0, 1, 2], data=dict(size=[10, 20])), parallel=True, num_workers=2)
+        df = runexp.utils.results_to_df(tempdir, ["builder.txt", "total.txt"])
+        # built once by the main process, and inherited by the workers
+        self.assertEqual(set(df["builder/builder"]), {os.getpid()})
+        self.assertEqual(list(df["total/total"]), [45] * 3 + [190] * 3)
+
+        # only the objects of the first distinct subsets which fit in the cache are built before forking
+        runexp.runexp.shared_objects.clear()
+        runner.shared_cache_size = 2
+        tasks = iter([(dict(seed=seed, data=dict(size=size)), i) for i, (size, seed) in enumerate([(1, 0), (1, 1), (2, 0), (2, 1), (3, 0)])])
+        self.assertEqual(len(runner.preload_shared(tasks)), 3)
+        self.assertEqual(len(runexp.runexp.shared_objects), 2)
+        self.assertEqual(len(list(tasks)), 2)
+
+        calls = []
+        @runexp.memoize(keys=["data/size"], maxsize=1)
+        def load(config):
+            calls.append(config)
+            return config["data"]["size"]
+        for size in [10, 10, 20, 20, 10]:
+            self.assertEqual(load(dict(data=dict(size=size, other=len(calls)))), size)
+        self.assertEqual(len(calls), 3)
+
+    def test_result_cache(self):
+        tempdir = tempfile.mkdtemp()
+        cache_dir = os.path.join(tempdir, "cache")
+        config = dict(size=[1, 2, 3], seed=0)
+        runner = self.MyRunner(mixed, output=os.path.join(tempdir, "first"), cache_dir=cache_dir, store="both")
+        runner.run_batch(config=config)
+        self.assertEqual(len(runner.cache.entries()), 3)
+
+        # the same experiments in another output directory are linked from the cache, failed experiments are not cached
+        runner = self.MyRunner(fail, output=os.path.join(tempdir, "second"), cache_dir=cache_dir, version=runner.version)
+        runner.run_batch(config=dict(size=[1, 2, 3, 4], seed=0))
+        manifest = runexp.utils.read_manifest(runner.output_dir)
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done", "done", "done", "failed"])
+        with open(os.path.join(runner.output_dir, "000002", runexp.utils.META), "r") as f:
+            self.assertIn("cached", json.load(f))
+        self.assertGreater(os.stat(os.path.join(runner.output_dir, "000002", "trace.lst")).st_nlink, 1)
+        df = runexp.utils.results_to_df(runner.output_dir, ["size.txt", "trace.lst"], ignore_missing=True)
+        self.assertEqual(list(df["trace/trace"])[:3], [[0], [0, 1], [0, 1, 2]])
+        self.assertEqual(len(runner.cache.entries()), 3)
+
+        # cached rows go to the result store
+        runner = self.MyRunner(fail, output=os.path.join(tempdir, "third"), cache_dir=cache_dir, version=runner.version, store="only")
+        runner.run_batch(config=config)
+        df = runexp.utils.results_to_df(runner.output_dir, ["size", "stats"], store=True)
+        self.assertEqual(list(df["size/size"]), [1, 2, 3])
+
+        # a different version does not use the cache, pruning removes the least recently used results
+        runner = self.MyRunner(mixed, output=os.path.join(tempdir, "fourth"), cache_dir=cache_dir, cache_max_size=0.0, version="v2")
+        runner.run_batch(config=config)
+        with open(os.path.join(runner.output_dir, "000002", runexp.utils.META), "r") as f:
+            self.assertNotIn("cached", json.load(f))
+        self.assertEqual(len(runner.cache.entries()), 0)
+
+        # an entry pruned by another batch after it was looked up is a cache miss
+        runner = self.MyRunner(mixed, output=os.path.join(tempdir, "fifth"), cache_dir=cache_dir, version="v3")
+        runner.run_batch(config=dict(size=2, seed=0))
+        lookup = runner.lookup_cache
+        def pruned_lookup(config):
+            entry = lookup(config)
+            shutil.rmtree(entry['path'])
+            return entry
+        runner.lookup_cache = pruned_lookup
+        runner.run_experiment(dict(size=2, seed=0))
+        self.assertEqual(runexp.utils.read_manifest(runner.output_dir)["000002"]['status'], "done")
+        with open(os.path.join(runner.output_dir, "000002", runexp.utils.META), "r") as f:
+            self.assertNotIn("cached", json.load(f))
+
+    def test_executors(self):
+        tempdir = tempfile.mkdtemp()
+        config = dict(size=[1, 2, 3, 4, 5, 6, 7, 8], seed=0)
+        for executor in ["thread", "asyncio"]:
+            runner = self.MyRunner(wait, output=os.path.join(tempdir, executor), timeout=None if executor == "thread" else 0.75)
+            start = time.time()
+            runner.run_batch(config=config, parallel=True, num_workers=8, executor=executor)
+            self.assertLess(time.time() - start, 3.0) # all experiments wait at the same time
+            manifest = runexp.utils.read_manifest(runner.output_dir)
+            self.assertEqual(len(manifest), 8)
+            df = runexp.utils.results_to_df(runner.output_dir, ["pid.txt"], ignore_missing=True)
+            self.assertEqual(set(df["pid/pid"].dropna()), {os.getpid()})
+
+        # experiments over the timeout are cancelled
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done"] * 7 + ["timeout"])
+        # an async function also runs without the asyncio executor
+        runner = self.MyRunner(wait, output=os.path.join(tempdir, "process"))
+        runner.run_batch(config=dict(size=1, seed=0), parallel=True, num_workers=1)
+        self.assertEqual(runexp.utils.results_to_df(runner.output_dir, ["size.txt"])["size/size"].tolist(), [1])
+        with self.assertRaises(ValueError):
+            self.MyRunner(wait, output=tempdir, confirm=False, memory_limit=1024).run_batch(config, parallel=True, executor="thread")
+        for executor in ["thread", "asyncio"]: # profiling experiments in several threads at once fails on python 3.12+
+            with self.assertRaises(ValueError):
+                self.MyRunner(wait, output=tempdir, confirm=False, profile="cpu").run_batch(config, parallel=True, executor=executor)
+
+    def test_command(self):
+        tempdir = tempfile.mkdtemp()
+        script = ("import sys, time; size, mode = int(sys.argv[1]), sys.argv[2]; print('x' * 100000); print('warning', file=sys.stderr)\n"
+                  "if mode == 'alloc': data = bytearray(size * 1024 * 1024)\n"
+                  "if mode == 'sleep': time.sleep(size)\n"
+                  "if mode == 'fail': sys.exit(3)\n"
+                  "while mode == 'busy' and time.process_time() < 0.5: pass\n"
+                  "print('### metrics ###'); print(f'size: {size}'); print('mode=' + mode); print('stats: {\"mean\": 1.5}'); print('stdout: 1')")
+        with open(os.path.join(tempdir, "tool.py"), "w") as f:
+            f.write(script)
+        runner = runexp.CommandRunner(f"{sys.executable} {os.path.join(tempdir, 'tool.py')} {{size}} {{mode}}", output=os.path.join(tempdir, "results"),
+                                      memory_limit=512, timeout=2)
+        config = dict(size=[1, 1024], mode=["ok", "alloc", "sleep", "fail"])
+        runner.run_batch(config=config, parallel=True, num_workers=8, executor="thread")
+        manifest = runexp.utils.read_manifest(runner.output_dir)
+        statuses = [manifest[d]['status'] for d in sorted(manifest)]
+        self.assertEqual(statuses, ["done", "done", "done", "failed", "done", "timeout", "failed", "failed"])
+
+        # output is streamed to files, the metrics end up in the results
+        df = runexp.utils.results_to_df(runner.output_dir, ["size.txt", "mode.txt", "stats.json"], ignore_missing=True)
+        self.assertEqual(df["size/size"].tolist()[:3], [1, 1024, 1])
+        self.assertEqual(df["mode/mode"].tolist()[:3], ["ok", "ok", "alloc"])
+        self.assertEqual(df["stats/mean"].tolist()[0], 1.5)
+        self.assertGreater(os.path.getsize(os.path.join(runner.output_dir, "000001", runexp.command.STDOUT)), 100000)
+        with open(os.path.join(runner.output_dir, "000004", runexp.command.STDERR), "r") as f:
+            self.assertIn("MemoryError", f.read()) # 1GB over the memory limit
+        with open(os.path.join(runner.output_dir, "000007", "err.txt"), "r") as f:
+            self.assertIn("returned non-zero exit status 3", f.read())
+        # metrics never overwrite the output of the command
+        self.assertIn("metric_stdout.txt", os.listdir(os.path.join(runner.output_dir, "000001")))
+
+        # in worker processes, the limits apply before the command starts
+        runner = runexp.CommandRunner(runner.command, output=os.path.join(tempdir, "process"), memory_limit=512)
+        runner.run_batch(config=dict(size=1024, mode="alloc"), parallel=True, num_workers=1)
+        with open(os.path.join(runner.output_dir, "000001", runexp.command.STDERR), "r") as f:
+            self.assertIn("MemoryError", f.read())
+
+        # the meta holds the resource usage of the command, not of the thread waiting for it
+        runner = runexp.CommandRunner(runner.command, output=os.path.join(tempdir, "usage"))
+        runner.run_batch(config=dict(size=[200], mode=["busy", "alloc"]), parallel=True, num_workers=2, executor="thread")
+        df = runexp.utils.results_to_df(runner.output_dir, ["runexp_meta.json"])
+        self.assertGreater(df["runexp_meta/cpu_user"].iloc[0] + df["runexp_meta/cpu_system"].iloc[0], 0.4)
+        self.assertGreater(df["runexp_meta/peak_rss_mb"].iloc[1], 200)
+        self.assertLess(df["runexp_meta/peak_rss_mb"].iloc[0], 200)
+
+    def test_async_writes(self):
+        tempdir = tempfile.mkdtemp()
+        config = dict(size=list(range(1, 21)), seed=0)
+        for executor in ["process", "thread", None]:
+            runner = self.MyRunner(mixed, output=os.path.join(tempdir, str(executor)), async_writes=True)
+            runner.writer_queue = 2
+            runner.run_batch(config=config, parallel=executor is not None, executor=executor or "process", num_workers=2, tasks_per_child=None)
+
+            # all results are written and marked as finished at the end of the batch
+            manifest = runexp.utils.read_manifest(runner.output_dir)
+            self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done"] * 20)
+            self.assertEqual(sorted(manifest["000003"]['artifacts']), ["runexp_meta.json", "size.txt", "stats.json", "trace.lst"])
+            self.assertFalse(any(fname.startswith(runexp.TMP_PREFIX) for d in manifest for fname in os.listdir(os.path.join(runner.output_dir, d))))
+            df = runexp.utils.results_to_df(runner.output_dir, ["trace.lst"])
+            self.assertEqual(sorted(len(trace) for trace in df["trace/trace"]), list(range(1, 21)))
+
+        # results which can not be written in a worker fail their run, and are reported by the batch
+        runner = self.MyRunner(unsaveable, output=os.path.join(tempdir, "unsaveable"), async_writes=True)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            runner.run_batch(config=dict(size=[1, 2, 3], seed=0), parallel=True, num_workers=2, tasks_per_child=None, status_interval=None)
+        self.assertIn("1 experiments failed", out.getvalue())
+        manifest = runexp.utils.read_manifest(runner.output_dir)
+        self.assertEqual([manifest[d]['status'] for d in sorted(manifest)], ["done", "failed", "done"])
+
+        # experiments starting at the same time in threads share the writer of their process
+        runexp.writer.flush_writer()
+        runexp.writer._forget_writer()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            writers = list(pool.map(lambda _: runexp.writer.result_writer(), range(32)))
+        self.assertEqual(len({id(writer) for writer in writers}), 1)
+
+        with self.assertRaises(ValueError):
+            self.MyRunner(mixed, output=tempdir, confirm=False, async_writes=True, store="both")
+
+    def test_memlimit_reset(self):
+        tempdir = os.path.join(tempfile.mkdtemp(), "results")
+        runner = self.MyRunner(fail, output=tempdir, memory_limit=1024)
+        before = resource.getrlimit(resource.RLIMIT_AS)
+        runner.run_experiment(dict(key="val"))
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_AS), before)
 
     def test_memlimit(self):
         tempdir = os.path.join(tempfile.mkdtemp(), "results")
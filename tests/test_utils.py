@@ -3,8 +3,8 @@ import unittest
 
 import pandas as pd
 
-from runexp import unravel_dict
-from runexp.utils import flat_dict
+from runexp import unravel_dict, iter_unravel, count_unravel, unravel_at
+from runexp.utils import flat_dict, config_hash
 
 
 class TestDictUtils(unittest.TestCase):
@@ -77,6 +77,43 @@ class TestDictUtils(unittest.TestCase):
         dicts = unravel_dict(config)
         self.assertEqual(len(dicts), 31 + 31 * 2)
 
+    def test_iter_unravel(self):
+        # same configs in the same order as the original (recursive) unravel, the first keys vary fastest
+        config = dict(a=[1, 2], b=dict(c=["x", "y"], d=[dict(e=[3, 4]), 5]))
+        expected = [dict(a=a, b=dict(c=c, d=d)) for d in [dict(e=3), dict(e=4), 5] for c in ["x", "y"] for a in [1, 2]]
+        self.assertEqual(expected[:3], [dict(a=1, b=dict(c="x", d=dict(e=3))), dict(a=2, b=dict(c="x", d=dict(e=3))),
+                                        dict(a=1, b=dict(c="y", d=dict(e=3)))])
+        self.assertEqual(list(iter_unravel(config)), expected)
+        self.assertEqual(count_unravel(config), 12)
+
+        config = dict(r=dict(_from=0, _to=4, _step=[2, 3]), t_dt=dict(_from="2025-01-01", _to="2025-01-01 16:00", _step="8 hours"))
+        times = [dict(start=pd.Timestamp(start), delta=pd.Timedelta("8 hours")) for start in ["2025-01-01 00:00", "2025-01-01 08:00"]]
+        self.assertEqual(list(iter_unravel(config)), [dict(r=r, t_dt=t) for t in times for r in [0, 2, 0, 3]])
+        self.assertEqual(count_unravel(config), 8)
+        # an empty list has no configs
+        self.assertEqual(list(iter_unravel(config | dict(e=[]))), [])
+
+    def test_count_unravel_huge(self):
+        config = {f"a{i}": list(range(10)) for i in range(12)}
+        self.assertEqual(count_unravel(config), 10 ** 12)
+        first = next(iter_unravel(config))
+        self.assertEqual(first, {f"a{i}": 0 for i in range(12)})
+
+    def test_unravel_at(self):
+        config = dict(
+            a1=dict(_from=0, _to=10, _step=[2, 3]),
+            a2=dict(a21=["v21_a", "v21_b"], a22=[dict(x=[1, 2]), 3]),
+            a3_dt=dict(_from="2025-01-01", _to="2025-01-02", _step="8 hours")
+        )
+        dicts = unravel_dict(config)
+        self.assertEqual([unravel_at(config, i) for i in range(len(dicts))], dicts)
+        self.assertEqual(unravel_at(config, -1), dicts[-1])
+        self.assertEqual(unravel_at(config, slice(100, 200)), dicts[100:200])
+        self.assertRaises(IndexError, unravel_at, config, len(dicts))
+
+        huge = {f"a{i}": list(range(10)) for i in range(12)}
+        self.assertEqual(unravel_at(huge, 123456), {f"a{i}": int(d) for i, d in enumerate("654321000000")})
+
     def test_flatten(self):
         config = dict(
             a1="v1",
@@ -92,4 +129,10 @@ class TestDictUtils(unittest.TestCase):
         flat = flat_dict(config, separator="$")
         self.assertDictEqual(flat,
                              {'a1': 'v1', 'a2$a21': 'v21', 'a2$a22': 'v22', 'a2$a23': 'v23', 'a3$a31$a311': 'v311', 'a3$a31$a312': 'v312'}
-        )
\ No newline at end of file
+        )
+
+    def test_config_hash(self):
+        config = dict(a1="v1", a2=dict(a21=1, a22=[1, 2]), a3=pd.Timestamp("2025-01-01"))
+        reordered = dict(a3="2025-01-01 00:00:00", a2=dict(a22=[1, 2], a21=1), a1="v1")
+        self.assertEqual(config_hash(config), config_hash(reordered))
+        self.assertNotEqual(config_hash(config), config_hash(config | dict(a1="v2")))